@@ -3,15 +3,28 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from db import setup_db, shutdown_db
-from routers import simulations, users, classrooms
+from dependencies.responses import TimedJSONResponse
+from internals.counters import cancel_counters_job, start_counters_job
+from internals.indexes import INDEX_DIAGNOSTICS, ensure_indexes, explain_queries
+from internals.metrics import MetricsMiddleware
+from internals.simulation import cancel_simulation_jobs, recover_stale_simulations, shutdown_executor
+from routers import simulations, users, classrooms, system, metrics
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-  await setup_db()
+  _db = await setup_db()
+  await ensure_indexes(_db)
+  await recover_stale_simulations(_db)
+  if INDEX_DIAGNOSTICS:
+    await explain_queries(_db)
+  start_counters_job(_db)
   yield
+  cancel_counters_job()
+  await cancel_simulation_jobs()
+  shutdown_executor()
   await shutdown_db()
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=TimedJSONResponse)
 
 origins = [
   "*",
@@ -25,9 +38,13 @@ app.add_middleware(
   allow_headers=["*"],
 )
 
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(users.router)
 app.include_router(simulations.router)
 app.include_router(classrooms.router)
+app.include_router(system.router)
+app.include_router(metrics.router)
 
 
 
@@ -0,0 +1,89 @@
+import json
+import os
+
+import numpy as np
+
+BASELINES_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+
+# Relative slack before a timing counts as a regression, timings are noisy across runs and machines
+TIMING_TOLERANCE = float(os.getenv('BENCHMARK_TOLERANCE', 0.25))
+
+def summarize(latencies: list, elapsed: float, **extra) -> dict:
+  latencies = np.asarray(latencies) * 1000
+
+  return {
+    "iterations": int(latencies.size),
+    "throughput": round(latencies.size / elapsed, 2) if elapsed > 0 else None,
+    "p50_ms": round(float(np.percentile(latencies, 50)), 3) if latencies.size else None,
+    "p99_ms": round(float(np.percentile(latencies, 99)), 3) if latencies.size else None,
+    **extra,
+  }
+
+def print_results(results: dict):
+  columns = ["iterations", "throughput", "p50_ms", "p99_ms", "db_ops_per_request", "errors"]
+  width = max([len(name) for name in results] + [10])
+
+  print("%-*s" % (width, "benchmark") + "".join("%20s" % column for column in columns))
+  for name, result in results.items():
+    print("%-*s" % (width, name) + "".join("%20s" % ("-" if result.get(column) is None else result[column]) for column in columns))
+
+def baseline_path(suite: str) -> str:
+  return os.path.join(BASELINES_DIR, suite + ".json")
+
+def save_baseline(suite: str, results: dict, scale: float):
+  # The scale is kept along, request counts and data sizes change the timings and the db operations per request
+  with open(baseline_path(suite), "w") as file:
+    json.dump({"scale": scale, "results": results}, file, indent=2, sort_keys=True)
+    file.write("\n")
+
+def load_baseline(suite: str) -> dict | None:
+  if not os.path.exists(baseline_path(suite)):
+    return None
+
+  with open(baseline_path(suite)) as file:
+    return json.load(file)
+
+def compare_baseline(baseline: dict, results: dict) -> list:
+  regressions = []
+  for name, result in results.items():
+    reference = baseline["results"].get(name)
+    if reference is None:
+      continue
+
+    for column in ("p50_ms", "p99_ms"):
+      if result.get(column) and reference.get(column) and result[column] > reference[column] * (1 + TIMING_TOLERANCE):
+        regressions.append("%s: %s %.3f > %.3f" % (name, column, result[column], reference[column]))
+
+    if result.get("throughput") and reference.get("throughput") and result["throughput"] < reference["throughput"] / (1 + TIMING_TOLERANCE):
+      regressions.append("%s: throughput %.2f < %.2f" % (name, result["throughput"], reference["throughput"]))
+
+    # The number of MongoDB operations does not depend on the machine, any increase is a regression
+    if result.get("db_ops_per_request") is not None and reference.get("db_ops_per_request") is not None and result["db_ops_per_request"] > reference["db_ops_per_request"]:
+      regressions.append("%s: db_ops_per_request %.2f > %.2f" % (name, result["db_ops_per_request"], reference["db_ops_per_request"]))
+
+  return regressions
+
+def report(suite: str, results: dict, save: bool, scale: float) -> int:
+  print_results(results)
+
+  if save:
+    save_baseline(suite, results, scale)
+    print("\nBaseline saved to %s" % baseline_path(suite))
+    return 0
+
+  baseline = load_baseline(suite)
+  if baseline is None:
+    return 0
+
+  if baseline["scale"] != scale:
+    print("\nNot compared: %s was recorded at scale %s, this run used %s" % (baseline_path(suite), baseline["scale"], scale))
+    return 0
+
+  regressions = compare_baseline(baseline, results)
+  if regressions:
+    print("\nRegressions against %s:" % baseline_path(suite))
+    for regression in regressions:
+      print("  " + regression)
+    return 1
+
+  return 0
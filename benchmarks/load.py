@@ -0,0 +1,243 @@
+# End-to-end load scenarios driving the FastAPI app over ASGI, without a network hop
+#
+#   python -m benchmarks.load                                  in-process mongomock-motor stand-in
+#   python -m benchmarks.load --mongodb mongodb://localhost    throwaway "entropy_benchmark" database, dropped afterwards
+#   python -m benchmarks.load --save                           record a new baseline
+#
+# Baselines are per backend: benchmarks/baselines/load-mongomock.json and load-mongodb.json
+import argparse
+import asyncio
+import functools
+import inspect
+import logging
+import sys
+import time
+from datetime import timedelta
+
+import httpx
+from bson import ObjectId
+
+import db
+from benchmarks.common import report, summarize
+from internals import metrics
+from internals.auth import create_access_token, get_password_hash
+
+PASSWORD = "benchmark"
+
+def count_mongomock_commands():
+  # The stand-in does not speak the wire protocol, so the command listener never fires: count the collection calls instead
+  from mongomock_motor import AsyncMongoMockCollection
+
+  def counted(name, fn):
+    if inspect.iscoroutinefunction(fn):
+      @functools.wraps(fn)
+      async def wrapper(*args, **kwargs):
+        metrics.record_command(name, 0.0)
+        return await fn(*args, **kwargs)
+    else:
+      @functools.wraps(fn)
+      def wrapper(*args, **kwargs):
+        metrics.record_command(name, 0.0)
+        return fn(*args, **kwargs)
+
+    return wrapper
+
+  for name in ("find", "find_one", "find_one_and_update", "aggregate", "count_documents", "insert_one", "insert_many", "update_one", "update_many", "bulk_write", "delete_many"):
+    setattr(AsyncMongoMockCollection, name, counted(name, getattr(AsyncMongoMockCollection, name)))
+
+async def setup_backend(mongodb_url: str | None):
+  if mongodb_url:
+    db._MONGODB_URL = mongodb_url
+    db._MONGODB_DATABASE = "entropy_benchmark"
+    return await db.setup_db()
+
+  from mongomock_motor import AsyncMongoMockClient
+
+  count_mongomock_commands()
+
+  db._client = AsyncMongoMockClient()
+  db._db = db._client[db._MONGODB_DATABASE]
+  return db._db
+
+async def run_scenario(client: httpx.AsyncClient, requests: list, concurrency: int) -> dict:
+  # requests: (method, url, token, json body), served by a fixed number of concurrent workers
+  queue = asyncio.Queue()
+  for request in requests:
+    queue.put_nowait(request)
+
+  latencies = []
+  errors = 0
+
+  async def worker():
+    nonlocal errors
+
+    while not queue.empty():
+      method, url, token, body = queue.get_nowait()
+      headers = {"Authorization": "Bearer " + token} if token else {}
+
+      start = time.perf_counter()
+      response = await client.request(method, url, headers=headers, json=body)
+      latencies.append(time.perf_counter() - start)
+
+      if response.status_code >= 400:
+        errors += 1
+
+  before = metrics.requests_totals()
+  start = time.perf_counter()
+  await asyncio.gather(*(worker() for _ in range(concurrency)))
+  elapsed = time.perf_counter() - start
+  after = metrics.requests_totals()
+
+  requests_count = after["requests"] - before["requests"]
+  db_ops_per_request = round((after["db_commands"] - before["db_commands"]) / requests_count, 2) if requests_count else None
+
+  return summarize(latencies, elapsed, db_ops_per_request=db_ops_per_request, errors=errors)
+
+def token_for(user: dict) -> str:
+  return create_access_token(data={"sub": user['username']}, expires_delta=timedelta(hours=1))
+
+async def seed_classrooms(_db, scale: float) -> dict:
+  teachers_count = 5
+  classrooms_per_teacher = 4
+  students_per_classroom = max(int(30 * scale), 1)
+  homeworks_per_classroom = 5
+
+  password = await get_password_hash(PASSWORD)
+
+  def user(role: int, idx: int) -> dict:
+    username = "%s%d" % ("teacher" if role == 1 else "student", idx)
+    return {"_id": ObjectId(), "username": username, "email": username + "@benchmark", "firstname": username, "lastname": "Benchmark", "password": password, "role": role, "is_disabled": False, "created_at": 0}
+
+  teachers = [user(1, idx) for idx in range(teachers_count)]
+  students = [user(0, idx) for idx in range(teachers_count * classrooms_per_teacher * students_per_classroom // 2)]
+  await _db["users"].insert_many(teachers + students)
+
+  classrooms, classrooms_students, homeworks, homeworks_maps = [], [], [], []
+  for teacher in teachers:
+    for idx in range(classrooms_per_teacher):
+      classroom = {"_id": ObjectId(), "name": "classroom%d" % idx, "size": students_per_classroom, "teacher_id": teacher['_id'], "invite_token": str(ObjectId()), "created_at": 0}
+      classrooms.append(classroom)
+
+      # Every student sits in two classrooms
+      members = [students[(len(classrooms) * students_per_classroom // 2 + offset) % len(students)] for offset in range(students_per_classroom)]
+      classrooms_students += [{"_id": ObjectId(), "classroom_id": classroom['_id'], "student_id": student['_id']} for student in members]
+
+      for homework_idx in range(homeworks_per_classroom):
+        homework = {"_id": ObjectId(), "classroom_id": classroom['_id'], "title": "homework%d" % homework_idx, "body": "", "node_min": 5, "node_max": 15, "start_datetime": 0, "expire_datetime": 1 if homework_idx % 2 else 4000000000, "created_at": 0}
+        homeworks.append(homework)
+
+        homeworks_maps += [
+          {"_id": ObjectId(), "homework_id": homework['_id'], "student_id": author['_id'], "nodes_count": 2, "edges_count": 1, "entropy": 0.0, "entropy_percent": 0.0, "effort": 0.0, "created_at": 0, "nodes_labels": ["a", "b"], "adjacency_matrix": [[0, 1], [0, 0]], "adjacency_matrix_labels": [["", "a-b"], ["", ""]], "map_name": "map"}
+          for author in [teacher] + members
+        ]
+
+  await _db["classrooms"].insert_many(classrooms)
+  await _db["classrooms_students"].insert_many(classrooms_students)
+  await _db["classrooms_homeworks"].insert_many(homeworks)
+  await _db["classrooms_homeworks_maps"].insert_many(homeworks_maps)
+
+  return {"teachers": teachers, "students": students, "classrooms": classrooms, "homeworks": homeworks, "classrooms_students": classrooms_students}
+
+def login_requests(seed: dict, scale: float) -> list:
+  users = seed["teachers"] + seed["students"]
+  return [("POST", "/users/token", None, {"username": users[idx % len(users)]['username'], "password": PASSWORD}) for idx in range(max(int(32 * scale), 1))]
+
+def dashboard_requests(seed: dict, scale: float) -> list:
+  requests = []
+
+  for _ in range(max(int(2 * scale), 1)):
+    for teacher in seed["teachers"]:
+      token = token_for(teacher)
+      requests.append(("GET", "/classrooms/", token, None))
+
+      for classroom in seed["classrooms"]:
+        if classroom['teacher_id'] != teacher['_id']:
+          continue
+
+        homework = next(homework for homework in seed["homeworks"] if homework['classroom_id'] == classroom['_id'])
+        requests += [
+          ("GET", "/classrooms/%s" % classroom['_id'], token, None),
+          ("GET", "/classrooms/%s/students" % classroom['_id'], token, None),
+          ("GET", "/classrooms/%s/homeworks" % classroom['_id'], token, None),
+          ("GET", "/classrooms/%s/homeworks/%s" % (classroom['_id'], homework['_id']), token, None),
+        ]
+
+    for student in seed["students"][:20]:
+      token = token_for(student)
+      requests += [
+        ("GET", "/classrooms/", token, None),
+        ("GET", "/users/homeworks", token, None),
+        ("GET", "/users/homeworks/expired", token, None),
+      ]
+
+  return requests
+
+def simulation_create_requests(seed: dict, scale: float) -> list:
+  token = token_for(seed["teachers"][0])
+  return [("POST", "/simulations/", token, {"name": "benchmark%d" % idx, "maps_count": max(int(10000 * scale), 1), "node_min": 10, "node_max": 25, "is_public": True, "seed": idx}) for idx in range(3)]
+
+async def simulation_read_requests(client: httpx.AsyncClient, seed: dict, scale: float) -> list:
+  token = token_for(seed["teachers"][0])
+  headers = {"Authorization": "Bearer " + token}
+
+  # Walk the first pages once to collect real keyset cursors
+  cursors = [None]
+  for _ in range(4):
+    response = await client.get("/simulations/benchmark0/maps", headers=headers, params={"limit": 100, "sort": "entropy", **({"after": cursors[-1]} if cursors[-1] else {})})
+    cursors.append(response.json()["next"])
+
+  requests = []
+  for _ in range(max(int(10 * scale), 1)):
+    requests += [
+      ("GET", "/simulations/", None, None),
+      ("GET", "/simulations/benchmark0/status", token, None),
+      ("GET", "/simulations/benchmark0/maps?limit=100", token, None),
+      ("GET", "/simulations/benchmark0/maps?limit=100&fields=entropy,effort&min_entropy=10", token, None),
+    ]
+    requests += [("GET", "/simulations/benchmark0/maps?limit=100&sort=entropy" + ("&after=" + cursor if cursor else ""), token, None) for cursor in cursors[:-1]]
+
+  return requests
+
+async def run(mongodb_url: str | None, scale: float, concurrency: int) -> dict:
+  from app import app
+
+  # Every login of the burst is a slow request by design
+  logging.getLogger(metrics.__name__).setLevel(logging.ERROR)
+
+  _db = await setup_backend(mongodb_url)
+  results = {}
+
+  try:
+    async with app.router.lifespan_context(app):
+      try:
+        seed = await seed_classrooms(_db, scale)
+
+        async with httpx.AsyncClient(app=app, base_url="http://benchmark") as client:
+          results["login_burst"] = await run_scenario(client, login_requests(seed, scale), concurrency)
+          results["classroom_dashboards"] = await run_scenario(client, dashboard_requests(seed, scale), concurrency)
+          results["simulation_create"] = await run_scenario(client, simulation_create_requests(seed, scale), 1)
+          results["simulation_reads"] = await run_scenario(client, await simulation_read_requests(client, seed, scale), concurrency)
+
+      finally:
+        # The lifespan shutdown closes the client, the throwaway database is dropped before
+        if mongodb_url:
+          await db._client.drop_database("entropy_benchmark")
+
+  finally:
+    await db.shutdown_db()
+
+  return results
+
+def main():
+  parser = argparse.ArgumentParser(description="End-to-end load scenarios")
+  parser.add_argument("--mongodb", help="MongoDB URL, the in-process mongomock-motor stand-in is used otherwise")
+  parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+  parser.add_argument("--scale", type=float, default=1.0, help="multiply the data set and request counts")
+  parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+  args = parser.parse_args()
+
+  results = asyncio.run(run(args.mongodb, args.scale, args.concurrency))
+  sys.exit(report("load-mongodb" if args.mongodb else "load-mongomock", results, args.save, args.scale))
+
+if __name__ == "__main__":
+  main()
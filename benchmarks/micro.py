@@ -0,0 +1,84 @@
+# Micro-benchmarks of the concept map hot paths
+#
+#   python -m benchmarks.micro           compare against benchmarks/baselines/micro.json
+#   python -m benchmarks.micro --save    record a new baseline
+import argparse
+import asyncio
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.common import report, summarize
+from dependencies.utils import ConceptMap, generate_concept_maps
+from internals.scores import score_map, scores_cache, scores_mongodb
+
+NODES_RANGES = [(3, 10), (10, 30), (30, 100)]
+
+def measure(fn, iterations: int) -> dict:
+  latencies = []
+
+  start = time.perf_counter()
+  for _ in range(iterations):
+    call_start = time.perf_counter()
+    fn()
+    latencies.append(time.perf_counter() - call_start)
+
+  return summarize(latencies, time.perf_counter() - start)
+
+def homework_map(rng: np.random.Generator, node_min: int, node_max: int) -> dict:
+  # Homework maps reach the scoring path as JSON lists, as submitted by the clients
+  concept_map = ConceptMap()
+  concept_map.generate(node_min, node_max, rng=rng)
+
+  return {
+    "adjacency_matrix": concept_map.get_adjacency_matrix().tolist(),
+    "nodes_count": concept_map.get_nodes_count(),
+    "edges_count": concept_map.get_edges_count(),
+  }
+
+def run(scale: float) -> dict:
+  rng = np.random.default_rng(0)
+  results = {}
+
+  # Homework maps go through the handler scoring path, in-process tier only: no MongoDB round trip is measured
+  loop = asyncio.new_event_loop()
+  scores_mongodb.enabled = False
+
+  for node_min, node_max in NODES_RANGES:
+    label = "%d-%d" % (node_min, node_max)
+    iterations = max(int(200 * scale), 1)
+
+    results["concept_map.generate[%s]" % label] = measure(lambda: ConceptMap().generate(node_min, node_max, rng=rng), iterations)
+
+    concept_maps = [ConceptMap() for _ in range(iterations)]
+    for concept_map in concept_maps:
+      concept_map.generate(node_min, node_max, rng=rng)
+    concept_maps = iter(concept_maps)
+    results["concept_map.calculate_entropy[%s]" % label] = measure(lambda: next(concept_maps).calculate_entropy(), iterations)
+
+    results["generate_concept_maps[%s,x1000]" % label] = measure(lambda: generate_concept_maps(node_min, node_max, 1000, rng=rng), max(int(10 * scale), 1))
+
+    homework_maps = [homework_map(rng, node_min, node_max) for _ in range(iterations)]
+    homework_maps = iter(homework_maps)
+
+    def score_homework_map():
+      submitted = next(homework_maps)
+      loop.run_until_complete(score_map(None, submitted['adjacency_matrix'], submitted['nodes_count'], submitted['edges_count']))
+
+    scores_cache.clear()
+    results["homework_scoring[%s]" % label] = measure(score_homework_map, iterations)
+
+  loop.close()
+  return results
+
+def main():
+  parser = argparse.ArgumentParser(description="Concept map micro-benchmarks")
+  parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+  parser.add_argument("--scale", type=float, default=1.0, help="multiply the number of iterations")
+  args = parser.parse_args()
+
+  sys.exit(report("micro", run(args.scale), args.save, args.scale))
+
+if __name__ == "__main__":
+  main()
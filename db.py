@@ -1,27 +1,158 @@
+import asyncio
 import os
+import threading
 import motor.motor_asyncio
 from dotenv import load_dotenv
+from pymongo import ReadPreference, monitoring
+
+from internals.metrics import command_metrics
 
 load_dotenv()
-			
+
 _MONGODB_URL = os.getenv('MONGODB_URL')
+_MONGODB_DATABASE = os.getenv('MONGODB_DATABASE', 'entropy')
+
+MONGODB_MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', 100))
+MONGODB_MIN_POOL_SIZE = int(os.getenv('MONGODB_MIN_POOL_SIZE', 0))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv('MONGODB_MAX_IDLE_TIME_MS', 0)) or None
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 0)) or None
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv('MONGODB_CONNECT_TIMEOUT_MS', 20000))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv('MONGODB_SOCKET_TIMEOUT_MS', 0)) or None
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 30000))
+# e.g. "zstd,snappy,zlib": zstd needs the zstandard package and snappy python-snappy, the server picks the first one it supports
+MONGODB_COMPRESSORS = os.getenv('MONGODB_COMPRESSORS', '')
+MONGODB_READ_PREFERENCE = os.getenv('MONGODB_READ_PREFERENCE', 'primary')
+# Read preference of the heavy read-only queries (simulation maps listings and exports)
+MONGODB_HEAVY_READ_PREFERENCE = os.getenv('MONGODB_HEAVY_READ_PREFERENCE', 'primary')
+
+READ_PREFERENCES = {
+  'primary': ReadPreference.PRIMARY,
+  'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+  'secondary': ReadPreference.SECONDARY,
+  'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+  'nearest': ReadPreference.NEAREST,
+}
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+  # Connection pool counters per server, updated from the driver threads
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.pools = {}
+
+  def update(self, address, **changes):
+    with self.lock:
+      pool = self.pools.setdefault("%s:%s" % address, {"open": 0, "in_use": 0, "checkouts": 0, "checkout_failures": 0, "cleared": 0})
+      for key, value in changes.items():
+        pool[key] += value
+
+  def stats(self) -> dict:
+    with self.lock:
+      return {address: dict(pool) for address, pool in self.pools.items()}
+
+  def pool_created(self, event):
+    self.update(event.address)
+
+  def pool_ready(self, event):
+    pass
+
+  def pool_cleared(self, event):
+    self.update(event.address, cleared=1)
+
+  def pool_closed(self, event):
+    with self.lock:
+      self.pools.pop("%s:%s" % event.address, None)
+
+  def connection_created(self, event):
+    self.update(event.address, open=1)
+
+  def connection_ready(self, event):
+    pass
+
+  def connection_closed(self, event):
+    self.update(event.address, open=-1)
+
+  def connection_check_out_started(self, event):
+    pass
+
+  def connection_check_out_failed(self, event):
+    self.update(event.address, checkout_failures=1)
+
+  def connection_checked_out(self, event):
+    self.update(event.address, in_use=1, checkouts=1)
 
-_db = None 
+  def connection_checked_in(self, event):
+    self.update(event.address, in_use=-1)
+
+pool_stats = PoolStatsListener()
+
+_client = None
+_db = None
+_read_db = None
+_lock = asyncio.Lock()
+
+def client_options() -> dict:
+  options = {
+    "maxPoolSize": MONGODB_MAX_POOL_SIZE,
+    "minPoolSize": MONGODB_MIN_POOL_SIZE,
+    "maxIdleTimeMS": MONGODB_MAX_IDLE_TIME_MS,
+    "waitQueueTimeoutMS": MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+    "connectTimeoutMS": MONGODB_CONNECT_TIMEOUT_MS,
+    "socketTimeoutMS": MONGODB_SOCKET_TIMEOUT_MS,
+    "serverSelectionTimeoutMS": MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+    "read_preference": READ_PREFERENCES[MONGODB_READ_PREFERENCE],
+    "event_listeners": [pool_stats, command_metrics],
+  }
+
+  if MONGODB_COMPRESSORS:
+    options["compressors"] = MONGODB_COMPRESSORS
+
+  return options
 
 async def setup_db():
-  global _db
-  client = motor.motor_asyncio.AsyncIOMotorClient(_MONGODB_URL)
-  _db = client.entropy
+  global _client, _db, _read_db
+
+  # A single client per process: concurrent first calls wait for the one being created
+  async with _lock:
+    if _db is None:
+      _client = motor.motor_asyncio.AsyncIOMotorClient(_MONGODB_URL, **client_options())
+      _db = _client[_MONGODB_DATABASE]
+      _read_db = _db.with_options(read_preference=READ_PREFERENCES[MONGODB_HEAVY_READ_PREFERENCE])
+
   return _db
 
 async def get_db():
   global _db
   if _db is not None:
       return _db
-  
+
   db = await setup_db()
   return db
 
+async def get_read_db():
+  db = await get_db()
+
+  if _read_db is not None:
+    return _read_db
+
+  return db
+
+def db_stats() -> dict:
+  return {
+    "max_pool_size": MONGODB_MAX_POOL_SIZE,
+    "min_pool_size": MONGODB_MIN_POOL_SIZE,
+    "read_preference": MONGODB_READ_PREFERENCE,
+    "heavy_read_preference": MONGODB_HEAVY_READ_PREFERENCE,
+    "compressors": MONGODB_COMPRESSORS.split(",") if MONGODB_COMPRESSORS else [],
+    "pools": pool_stats.stats(),
+  }
+
 async def shutdown_db():
-  global _db
-  _db = None
\ No newline at end of file
+  global _client, _db, _read_db
+
+  async with _lock:
+    if _client is not None:
+      _client.close()
+
+    _client = None
+    _db = None
+    _read_db = None
@@ -0,0 +1,129 @@
+import os
+from dotenv import load_dotenv
+
+import numpy as np
+
+load_dotenv()
+
+DEFAULT_ENGINE = os.getenv('CONCEPT_MAP_ENGINE', 'numpy')
+
+class NumpyEngine():
+	name = "numpy"
+
+	def random_tree(self, sequence: list, nodes_count: int) -> tuple[list, list]:
+		# Decode a Prüfer sequence into parent links, rooting the tree at the last node
+		degree = [1] * nodes_count
+		for node in sequence:
+			degree[node] += 1
+
+		children = [[] for _ in range(nodes_count)]
+
+		ptr = 0
+		while ptr < nodes_count - 1 and degree[ptr] != 1:
+			ptr += 1
+		leaf = ptr
+
+		for node in sequence:
+			children[node].append(leaf)
+			degree[leaf] -= 1
+			degree[node] -= 1
+
+			if node < ptr and degree[node] == 1:
+				leaf = node
+			else:
+				ptr += 1
+				while degree[ptr] != 1:
+					ptr += 1
+				leaf = ptr
+
+		if nodes_count > 1:
+			children[nodes_count - 1].append(leaf)
+
+		# Label nodes in breadth-first order, the same generations order networkx.topological_sort yields for a tree
+		ordered_nodes = [nodes_count - 1]
+		tree_parents = []
+		for idx, node in enumerate(ordered_nodes):
+			ordered_nodes += children[node]
+			tree_parents += [idx] * len(children[node])
+
+		return tree_parents, list(range(1, nodes_count))
+
+	def generate_batch(self, nodes_counts: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+		nodes_counts = np.asarray(nodes_counts, dtype=np.intp)
+		batch_size = nodes_counts.size
+		node_max = int(nodes_counts.max()) if batch_size else 0
+
+		adjacency_matrices = np.zeros((batch_size, node_max, node_max), dtype=np.uint8)
+
+		# Random trees, one Prüfer sequence per map drawn in a single call
+		sequences = (rng.random((batch_size, max(node_max - 2, 0))) * nodes_counts[:, None]).astype(np.intp).tolist()
+
+		tree_maps, tree_parents, tree_children = [], [], []
+		for idx, nodes_count in enumerate(nodes_counts.tolist()):
+			parents, children = self.random_tree(sequences[idx][:max(nodes_count - 2, 0)], nodes_count)
+			tree_maps += [idx] * len(children)
+			tree_parents += parents
+			tree_children += children
+
+		adjacency_matrices[tree_maps, tree_parents, tree_children] = 1
+
+		# Extra edges: nodes are labelled in topological order, so any edge i -> j with i < j keeps the graph acyclic
+		extra_edges_counts = (rng.random(batch_size) * (np.maximum(nodes_counts * 2 - 5, 0) + 1)).astype(np.intp)
+
+		maps = np.repeat(np.arange(batch_size), extra_edges_counts)
+		sizes = nodes_counts[maps]
+		first = (rng.random(maps.size) * sizes).astype(np.intp)
+		second = first + 1 + (rng.random(maps.size) * (sizes - 1 - first)).astype(np.intp)
+
+		keep = first + 1 < sizes - 1
+		adjacency_matrices[maps[keep], first[keep], second[keep]] = 1
+		return adjacency_matrices
+
+	def generate(self, nodes_count: int, rng: np.random.Generator) -> np.ndarray:
+		return self.generate_batch(np.array([nodes_count]), rng)[0]
+
+class NetworkxEngine():
+	name = "networkx"
+
+	def generate(self, nodes_count: int, rng: np.random.Generator) -> np.ndarray:
+		import networkx as nx
+
+		graph = nx.random_tree(nodes_count, seed=int(rng.integers(2 ** 32)), create_using=nx.DiGraph)
+		ordered_nodes = list(nx.topological_sort(graph))
+
+		# Maps of less than 3 nodes get no extra edge, as in the numpy engine
+		extra_edges_count = int(rng.integers(0, max(nodes_count * 2 - 5, 0), endpoint=True))
+
+		for _ in range(extra_edges_count):
+			random_first_node_idx = int(rng.integers(0, len(ordered_nodes) - 1, endpoint=True))
+			random_first_node = ordered_nodes[random_first_node_idx]
+
+			if random_first_node_idx + 1 < len(ordered_nodes) - 1:
+				random_second_node = ordered_nodes[int(rng.integers(random_first_node_idx + 1, len(ordered_nodes) - 1, endpoint=True))]
+
+				graph.add_edge(random_first_node, random_second_node)
+				ordered_nodes = list(nx.topological_sort(graph))
+
+		return nx.to_numpy_array(graph, dtype=np.uint8)
+
+	def generate_batch(self, nodes_counts: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+		node_max = int(np.max(nodes_counts, initial=0))
+		adjacency_matrices = np.zeros((len(nodes_counts), node_max, node_max), dtype=np.uint8)
+
+		for idx, nodes_count in enumerate(nodes_counts):
+			adjacency_matrices[idx, :nodes_count, :nodes_count] = self.generate(int(nodes_count), rng)
+
+		return adjacency_matrices
+
+ENGINES = {
+	NumpyEngine.name: NumpyEngine(),
+	NetworkxEngine.name: NetworkxEngine(),
+}
+
+def get_engine(name: str | None = None):
+	name = name or DEFAULT_ENGINE
+
+	if name not in ENGINES:
+		raise ValueError(f"Unknown concept map engine: {name}")
+
+	return ENGINES[name]
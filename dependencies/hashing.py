@@ -0,0 +1,66 @@
+import numpy as np
+
+WL_ITERATIONS = 3
+
+_C1 = np.uint64(0xBF58476D1CE4E5B9)
+_C2 = np.uint64(0x94D049BB133111EB)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_S30 = np.uint64(30)
+_S27 = np.uint64(27)
+_S31 = np.uint64(31)
+
+def mix64(values: np.ndarray) -> np.ndarray:
+	# splitmix64 finalizer, every operand stays uint64 so the arithmetic wraps instead of promoting to float
+	values = (values ^ (values >> _S30)) * _C1
+	values = (values ^ (values >> _S27)) * _C2
+	return values ^ (values >> _S31)
+
+def segment_sums(values: np.ndarray, segments: np.ndarray, size: int) -> np.ndarray:
+	# Wrapping uint64 sums of values grouped by their (sorted) segment, np.add.at being far slower
+	sums = np.zeros(size, dtype=np.uint64)
+
+	if segments.size:
+		starts = np.flatnonzero(np.concatenate(([True], segments[1:] != segments[:-1])))
+		sums[segments[starts]] = np.add.reduceat(values, starts)
+
+	return sums
+
+def canonical_hashes(adjacency_matrices, nodes_counts) -> np.ndarray:
+	# Weisfeiler-Lehman hash over in/out neighbourhoods: isomorphic maps share a hash, whatever their labelling or padding.
+	# Node labels start from the (out, in) degrees, so equal hashes imply equal degree sequences and therefore equal scores
+	adjacency_matrices = np.asarray(adjacency_matrices)
+	nodes_counts = np.asarray(nodes_counts, dtype=np.uint64)
+	batch_size, size = adjacency_matrices.shape[:2]
+
+	# Work on the edge list, flattening (map, node) pairs: maps are sparse, so this is O(edges) rather than O(nodes^2)
+	maps, sources, targets = np.nonzero(adjacency_matrices == 1)
+	sources = maps * size + sources
+	targets = maps * size + targets
+
+	out_degrees = np.bincount(sources, minlength=batch_size * size).astype(np.uint64)
+	in_degrees = np.bincount(targets, minlength=batch_size * size).astype(np.uint64)
+
+	# np.nonzero yields the edges sorted by source already, a stable argsort groups them by target
+	by_target = np.argsort(targets, kind='stable')
+
+	labels = mix64(out_degrees * _GOLDEN + mix64(in_degrees))
+
+	for iteration in range(WL_ITERATIONS):
+		# Neighbour multisets are folded with a wrapping sum of mixed labels, which does not depend on the node order
+		neighbours = mix64(labels + np.uint64(iteration))
+
+		successors = segment_sums(neighbours[targets], sources, batch_size * size)
+		predecessors = segment_sums(neighbours[sources][by_target], targets[by_target], batch_size * size)
+
+		labels = mix64(labels * _GOLDEN + mix64(successors) + mix64(predecessors ^ _C1))
+
+	valid = np.arange(size, dtype=np.uint64)[None, :] < nodes_counts[:, None]
+
+	return mix64((mix64(labels).reshape(batch_size, size) * valid).sum(axis=1) + nodes_counts * _C2)
+
+def format_hash(value) -> str:
+	return format(int(value), '016x')
+
+def score_keys(hashes, nodes_counts, edges_counts) -> list:
+	# Scoring cache keys: the counts are part of the key since homework submissions carry their own
+	return ["%016x:%d:%d" % key for key in zip(np.asarray(hashes).tolist(), np.asarray(nodes_counts).tolist(), np.asarray(edges_counts).tolist())]
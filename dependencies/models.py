@@ -1,6 +1,8 @@
-from typing import Optional, List
+from typing import Optional, List, Union
 from bson import ObjectId
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, validator
+
+from dependencies.utils import unpack_adjacency_matrix
 
 class PyObjectId(ObjectId):
 	@classmethod
@@ -30,7 +32,17 @@ class SimulationMap(BaseModel):
 	entropy_percent: float 
 	effort: float 
 	created_at: int
-	adjacency_matrix: List[List[int]]
+	schema_version: int = 1
+	canonical_hash: Optional[str]
+	multiplicity: int = 1
+	adjacency_matrix: Union[List[List[int]], str]
+
+	@validator('adjacency_matrix', pre=True)
+	def decode_adjacency_matrix(cls, v, values):
+		# Bit-packed matrices are decoded transparently, raw ones are served as a base64 string
+		if isinstance(v, bytes):
+			return unpack_adjacency_matrix(v, values['nodes_count']).tolist()
+		return v
 
 	class Config:
 		allow_population_by_field_name = True
@@ -45,7 +57,10 @@ class Simulation(BaseModel):
 	node_max: int
 	is_public: bool
 	owner_id: PyObjectId = Field(default_factory=PyObjectId)
+	seed: Optional[int]
+	dedupe: bool = False
 	created_at: Optional[int]
+	stats: Optional[dict]
 	maps: Optional[List[SimulationMap]]
 
 	class Config:
@@ -0,0 +1,114 @@
+import math
+
+import numpy as np
+
+def entropy_max_table(size: int) -> np.ndarray:
+	# The densest DAG links every node to all the following ones, so its out-degrees are n-1, ..., 1
+	# and entropy_max(n) = log2(1) + ... + log2(n-1) = log2((n-1)!)
+	return np.concatenate(([0, 0], np.cumsum(np.log2(np.arange(1, max(size, 2) - 1)))))[:size]
+
+# Fixed size: nodes counts may come from clients, bigger maps are computed through lgamma instead of growing the table
+_entropy_max = entropy_max_table(1024)
+
+_log2_factorial = np.frompyfunc(lambda nodes_count: math.lgamma(nodes_count) / math.log(2), 1, 1)
+
+def entropy_max(nodes_counts) -> np.ndarray:
+	nodes_counts = np.maximum(np.asarray(nodes_counts), 0)
+
+	# log2((n-1)!) = lgamma(n) / ln(2)
+	in_table = nodes_counts < _entropy_max.size
+	if in_table.all():
+		return _entropy_max[nodes_counts]
+
+	entropy = np.array(_entropy_max[np.where(in_table, nodes_counts, 0)])
+	entropy[~in_table] = _log2_factorial(nodes_counts[~in_table]).astype(float)
+	return entropy
+
+def matrix_rows(adjacency_matrix) -> np.ndarray:
+	if isinstance(adjacency_matrix, np.ndarray):
+		return adjacency_matrix.reshape(len(adjacency_matrix), -1)
+
+	# Submitted rows may differ in length, each one is padded with zeros up to the longest
+	rows = np.zeros((len(adjacency_matrix), max((len(row) for row in adjacency_matrix), default=0)))
+	for idx, row in enumerate(adjacency_matrix):
+		rows[idx, :len(row)] = row
+
+	return rows
+
+def pad_adjacency_matrices(adjacency_matrices) -> tuple[np.ndarray, np.ndarray]:
+	if isinstance(adjacency_matrices, np.ndarray) and adjacency_matrices.ndim == 3:
+		return adjacency_matrices, np.full(adjacency_matrices.shape[0], adjacency_matrices.shape[1])
+
+	# Ragged batch: pad every matrix with zeros up to the largest one
+	adjacency_matrices = [matrix_rows(adjacency_matrix) if len(adjacency_matrix) else np.zeros((0, 0)) for adjacency_matrix in adjacency_matrices]
+
+	rows_max = max((adjacency_matrix.shape[0] for adjacency_matrix in adjacency_matrices), default=0)
+	cols_max = max((adjacency_matrix.shape[1] for adjacency_matrix in adjacency_matrices), default=0)
+
+	padded = np.zeros((len(adjacency_matrices), rows_max, cols_max), dtype=np.uint8)
+	for idx, adjacency_matrix in enumerate(adjacency_matrices):
+		padded[idx, :adjacency_matrix.shape[0], :adjacency_matrix.shape[1]] = adjacency_matrix == 1
+
+	return padded, np.array([adjacency_matrix.shape[0] for adjacency_matrix in adjacency_matrices])
+
+def score_batch(adjacency_matrices, nodes_counts=None, edges_counts=None) -> dict:
+	adjacency_matrices, matrix_nodes_counts = pad_adjacency_matrices(adjacency_matrices)
+
+	nodes_counts = matrix_nodes_counts if nodes_counts is None else np.asarray(nodes_counts)
+
+	# Every link of a node with k links has probability 1/k, so its entropy reduces to log2(k)
+	links_counts = np.count_nonzero(adjacency_matrices == 1, axis=2)
+	entropy = np.log2(np.maximum(links_counts, 1)).sum(axis=1)
+
+	if edges_counts is None:
+		edges_counts = links_counts.sum(axis=1)
+
+	max_entropy = entropy_max(nodes_counts)
+
+	entropy_percent = np.divide(entropy * 100, max_entropy, out=np.zeros_like(entropy), where=max_entropy > 0)
+	entropy_percent[nodes_counts < 0] = np.nan
+
+	effort = (entropy_percent / 100) * nodes_counts * np.asarray(edges_counts)
+
+	return {
+		'entropy': entropy,
+		'entropy_percent': entropy_percent,
+		'effort': effort,
+	}
+
+def score_batch_memoized(adjacency_matrices, nodes_counts, edges_counts, keys: list, cache) -> dict:
+	# Scores are content-addressed: every distinct key is looked up once and only the missing ones get scored
+	positions = {}
+	for idx, key in enumerate(keys):
+		positions.setdefault(key, idx)
+
+	scores = {key: cache.get(key) for key in positions}
+
+	missing = [key for key, value in scores.items() if value is None]
+	if missing:
+		missing_positions = [positions[key] for key in missing]
+		computed = score_batch(adjacency_matrices[missing_positions], np.asarray(nodes_counts)[missing_positions], np.asarray(edges_counts)[missing_positions])
+
+		for position, key in enumerate(missing):
+			scores[key] = (float(computed['entropy'][position]), float(computed['entropy_percent'][position]), float(computed['effort'][position]))
+			cache.set(key, scores[key])
+
+	scores = np.array([scores[key] for key in keys], dtype=np.float64).reshape(len(keys), 3)
+
+	return {
+		'entropy': scores[:, 0],
+		'entropy_percent': scores[:, 1],
+		'effort': scores[:, 2],
+	}
+
+def color_bands(values, max_value: float) -> np.ndarray:
+	# Split [0, max_value] in thirds: 1 strictly inside the middle third, 2 above it, 0 otherwise
+	first_part = max_value / 3
+	second_part = first_part * 2
+
+	values = np.asarray(values)
+	return np.where((values > first_part) & (values < second_part), 1, np.where(values > second_part, 2, 0))
+
+def quantile_bands(values, low: float, high: float) -> np.ndarray:
+	# 0 below the low cut, 1 from the low cut up to the high one, 2 from the high cut on
+	return np.searchsorted(np.array([low, high]), np.asarray(values), side='right')
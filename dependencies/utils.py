@@ -2,9 +2,64 @@ from typing import Annotated
 
 from fastapi import Header, HTTPException
 
-import networkx as nx
-import random
-import math 
+import numpy as np
+from bson import Binary
+
+from dependencies.generators import get_engine
+from dependencies.hashing import canonical_hashes, score_keys
+from dependencies.scoring import score_batch, score_batch_memoized
+
+# 1: adjacency_matrix stored as a list of lists of "0"/"1" strings
+# 2: adjacency_matrix stored as a bit-packed binary (row-major, most significant bit first)
+MAP_SCHEMA_VERSION = 2
+
+def pack_adjacency_matrix(adjacency_matrix) -> Binary:
+	return Binary(np.packbits(np.asarray(adjacency_matrix) == 1).tobytes())
+
+def unpack_adjacency_matrix(data: bytes, nodes_count: int) -> np.ndarray:
+	return np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=nodes_count * nodes_count).reshape(nodes_count, nodes_count)
+
+def generate_concept_maps(node_min: int, node_max: int, count: int, engine: str | None = None, rng: np.random.Generator | None = None, dedupe: bool = False, scores_cache=None) -> dict:
+	if node_min > node_max:
+		count = 0
+		node_max = node_min
+
+	if rng is None:
+		rng = np.random.default_rng()
+
+	# Generate every adjacency matrix in a single batch, padded to the largest map
+	nodes_counts = rng.integers(node_min, node_max, size=count, endpoint=True)
+	adjacency_matrices = get_engine(engine).generate_batch(nodes_counts, rng)
+
+	hashes = canonical_hashes(adjacency_matrices, nodes_counts)
+	multiplicities = np.ones(len(hashes), dtype=np.int64)
+
+	# Dedupe mode keeps the first map of every isomorphism class, in generation order, with its number of occurrences
+	if dedupe:
+		_, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+		order = np.argsort(first)
+
+		multiplicities = np.bincount(inverse)[order]
+		hashes = hashes[first[order]]
+		nodes_counts = nodes_counts[first[order]]
+		adjacency_matrices = adjacency_matrices[first[order]]
+
+	edges_counts = np.count_nonzero(adjacency_matrices, axis=(1, 2))
+
+	# Score the whole batch in one vectorized pass, or only the maps not memoized yet
+	if scores_cache is None:
+		scores = score_batch(adjacency_matrices, nodes_counts)
+	else:
+		scores = score_batch_memoized(adjacency_matrices, nodes_counts, edges_counts, score_keys(hashes, nodes_counts, edges_counts), scores_cache)
+
+	return {
+		'nodes_counts': nodes_counts,
+		'edges_counts': edges_counts,
+		'adjacency_matrices': adjacency_matrices,
+		'canonical_hashes': hashes,
+		'multiplicities': multiplicities,
+		**scores,
+	}
 
 class ConceptMap():
 	color_entropy: int
@@ -16,45 +71,30 @@ class ConceptMap():
 	entropy_percent: float
 	effort: float
 
-	graph: nx.DiGraph
+	adjacency_matrix: np.ndarray
 
 	def __init__(self):
-		self.graph = nx.null_graph()
-		self.adjacency_matrix = None
+		self.adjacency_matrix = np.zeros((0, 0), dtype=np.uint8)
 		self.entropy = 0
 		self.entropy_percent = 0
 		self.effort = 0
-		self.ordered_nodes = []
 	
-	def generate(self, node_min: int, node_max: int) -> bool:
+	def generate(self, node_min: int, node_max: int, engine: str | None = None, rng: np.random.Generator | None = None) -> bool:
 		if node_min > node_max: # Check if minimum nodes is above than its maximum
 			return False
 
-		nodes_count = random.randint(node_min, node_max) # Generate a number between the minimum and the maximum of nodes count
-
-		self.graph = nx.random_tree(nodes_count, create_using=nx.DiGraph)
-		self.ordered_nodes = list(nx.topological_sort(self.graph))
-
-		extra_edges_count = random.randint(0, nodes_count * 2 - 5)
-
-		for _ in range(extra_edges_count):
-			random_first_node_idx = random.randint(0, len(self.ordered_nodes) - 1)
-			random_first_node = self.ordered_nodes[random_first_node_idx]
-						
-			if random_first_node_idx + 1 < len(self.ordered_nodes) - 1:
-				random_second_node = self.ordered_nodes[random.randint(random_first_node_idx + 1, len(self.ordered_nodes) - 1)]
+		if rng is None:
+			rng = np.random.default_rng()
 
-				self.graph.add_edge(random_first_node, random_second_node)
-				self.ordered_nodes = list(nx.topological_sort(self.graph))
+		nodes_count = int(rng.integers(node_min, node_max, endpoint=True)) # Generate a number between the minimum and the maximum of nodes count
 
-
-		# Convert the generated directed acyclic graph (DAG) to an adjacency matrix
-		self.adjacency_matrix = nx.adjacency_matrix(self.graph).todense()
+		# Generate a random directed acyclic graph (DAG) as an adjacency matrix
+		self.adjacency_matrix = get_engine(engine).generate(nodes_count, rng)
 
 		# Entropy calculation
 		self.calculate_entropy()
 		return True
-	
+
 	def set_entropy_percent(self, value): 
 		if(value >= 0 and value <= 100):
 			self.entropy_percent = value
@@ -66,10 +106,10 @@ class ConceptMap():
 		return self.adjacency_matrix
 
 	def get_nodes_count(self) -> int:
-		return self.graph.number_of_nodes()
+		return self.adjacency_matrix.shape[0]
 
 	def get_edges_count(self) -> int:
-		return self.graph.number_of_edges()
+		return int(np.count_nonzero(self.adjacency_matrix))
 
 	def get_entropy(self) -> int:
 		return self.entropy
@@ -78,26 +118,12 @@ class ConceptMap():
 		return self.effort 
 
 	def calculate_entropy(self) -> int:
-		entropy_max = [0, 0, 0, 1,2.584962501,4.584962501,6.906890596,9.491853096,12.29920802,15.29920802,18.46913302,21.79106111,25.25049273,28.83545523,32.53589495,36.34324987,40.25014047,44.25014047,48.33760331,52.50752831,56.75545583,61.07738392,65.46970134,69.92913296,74.45269492,79.03765742,83.68151361,88.38195333,93.13684083,97.94419575,102.8021767]
-		for x in self.adjacency_matrix:
-			links_count = 0 
-			for y in x: # Check for every node how many links it has
-				if y == 1:
-					links_count = links_count + 1
-			
-			node_entropy = 0
-			if links_count > 0:
-				probability = 1 / links_count 
-				for _ in range(links_count):
-					node_entropy = node_entropy + abs((probability * math.log(probability, 2))) # Entropy formula
-
-			self.entropy = self.entropy + node_entropy
-
-		if self.get_nodes_count() >= 0 and self.get_nodes_count() <= 30:
-			self.entropy_percent = (self.entropy / entropy_max[self.get_nodes_count()]) * 100
-
-			self.effort = (self.entropy_percent / 100) * self.get_nodes_count() * self.get_edges_count()
+		self.set_scores(score_batch(self.adjacency_matrix[None]), 0)
 
-	
-		
-		
\ No newline at end of file
+	def set_scores(self, scores: dict, idx: int):
+		self.entropy = float(scores['entropy'][idx])
+
+		# Maps with an invalid nodes count keep no entropy_percent nor effort
+		if not np.isnan(scores['entropy_percent'][idx]):
+			self.entropy_percent = float(scores['entropy_percent'][idx])
+			self.effort = float(scores['effort'][idx])
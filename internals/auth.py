@@ -1,8 +1,11 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
 import os
 from dotenv import load_dotenv
 from jose import JWTError, jwt
+from fastapi import HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
 load_dotenv()
@@ -11,14 +14,39 @@ SECRET_KEY = os.getenv('SECRET_KEY')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 4))
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv('PASSWORD_HASH_QUEUE_SIZE', 32))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def verify_password(plain_password, hashed_password):
-  return pwd_context.verify(plain_password, hashed_password)
+# bcrypt releases the GIL, so a small dedicated thread pool keeps hashing off the event loop
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password")
+_password_tasks = 0
+
+async def run_password_task(fn, *args):
+  global _password_tasks
+
+  # Fail fast instead of queueing unboundedly during a login storm
+  if _password_tasks >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_SIZE:
+    raise HTTPException(
+      status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+      detail="Too many authentication requests, please retry later",
+      headers={"Retry-After": "1"},
+    )
+
+  _password_tasks += 1
+  try:
+    return await asyncio.get_running_loop().run_in_executor(_password_executor, fn, *args)
+  finally:
+    _password_tasks -= 1
+
+async def verify_password(plain_password, hashed_password):
+  return await run_password_task(pwd_context.verify, plain_password, hashed_password)
 
-def get_password_hash(password):
-  return pwd_context.hash(password)
+async def get_password_hash(password):
+  return await run_password_task(pwd_context.hash, password)
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
   to_encode = data.copy()
@@ -0,0 +1,105 @@
+import os
+from dotenv import load_dotenv
+
+from bson import ObjectId
+from pymongo import ASCENDING
+
+from dependencies.scoring import color_bands, quantile_bands
+from internals.cache import LRUCache
+
+load_dotenv()
+
+PROVISIONAL_STATS_CACHE_TTL = float(os.getenv('PROVISIONAL_STATS_CACHE_TTL', 10))
+
+BANDED_FIELDS = ['entropy', 'entropy_percent', 'effort']
+
+# Stats of the simulations still running, keyed by simulation id: polling clients share one computation per TTL
+provisional_stats_cache = LRUCache("provisional_stats", 256, PROVISIONAL_STATS_CACHE_TTL)
+
+async def stored_range(_db, simulation: dict) -> dict:
+  # Minimum and maximum of the stored metrics, for simulations generated before the stats were kept
+  ranges = await _db["simulations_maps"].aggregate([
+    {'$match': {'simulation_id': ObjectId(simulation['_id'])}},
+    {'$group': {'_id': None, **{field + '_min': {'$min': '$' + field} for field in BANDED_FIELDS}, **{field + '_max': {'$max': '$' + field} for field in BANDED_FIELDS}}},
+  ]).to_list(None)
+  ranges = ranges[0] if ranges else {}
+
+  return {field: {'min': float(ranges.get(field + '_min') or 0), 'max': float(ranges.get(field + '_max') or 0)} for field in BANDED_FIELDS}
+
+async def stored_quantiles(_db, simulation: dict) -> dict:
+  # Tertile cuts read by skipping along the (simulation_id, field, _id) indexes, without loading the maps
+  query = {'simulation_id': ObjectId(simulation['_id'])}
+  maps_count = await _db["simulations_maps"].count_documents(query)
+
+  quantiles = {}
+  for field in BANDED_FIELDS:
+    cuts = []
+    for position in (maps_count // 3, maps_count * 2 // 3):
+      simulation_map = await _db["simulations_maps"].find(query, {field: 1}).sort([(field, ASCENDING), ('_id', ASCENDING)]).skip(position).limit(1).to_list(1)
+      cuts.append(float(simulation_map[0][field]) if simulation_map else 0.0)
+
+    quantiles[field] = cuts
+
+  return quantiles
+
+async def get_simulation_stats(_db, simulation: dict) -> dict:
+  stats = simulation.get('stats')
+  running = simulation.get('status', 'completed') == 'running'
+
+  if not stats and running:
+    stats = provisional_stats_cache.get(str(simulation['_id']))
+
+  if not stats:
+    ranges = await stored_range(_db, simulation)
+    quantiles = await stored_quantiles(_db, simulation)
+    stats = {field: {**ranges[field], 'quantiles': quantiles[field]} for field in BANDED_FIELDS}
+
+    # A running simulation is still growing, its stats are stored once it completes
+    if running:
+      provisional_stats_cache.set(str(simulation['_id']), stats)
+    else:
+      await _db["simulations"].update_one({'_id': simulation['_id']}, {'$set': {'stats': stats}})
+
+    simulation['stats'] = stats
+
+  return stats
+
+def band_cuts(stats: dict, banding: str) -> dict:
+  if banding == 'quantiles':
+    return {field: tuple(stats[field]['quantiles']) for field in BANDED_FIELDS}
+
+  return {field: (stats[field]['max'] / 3, stats[field]['max'] / 3 * 2) for field in BANDED_FIELDS}
+
+def band_simulation_maps(simulation_maps: list, stats: dict, banding: str) -> list:
+  # Colors are derived when serving, a map missing a metric (projection) does not get its color
+  cuts = band_cuts(stats, banding)
+
+  for field in BANDED_FIELDS:
+    banded = [simulation_map for simulation_map in simulation_maps if field in simulation_map]
+    if not banded:
+      continue
+
+    values = [simulation_map[field] for simulation_map in banded]
+    if banding == 'quantiles':
+      colors = quantile_bands(values, *cuts[field])
+    else:
+      colors = color_bands(values, stats[field]['max'])
+
+    for simulation_map, color in zip(banded, colors.tolist()):
+      simulation_map['color_' + field] = color
+
+  return simulation_maps
+
+def band_query(field: str, color: int, stats: dict, banding: str) -> dict:
+  # Color filters become ranges on the metric, served by the (simulation_id, field, _id) index
+  low, high = band_cuts(stats, banding)[field]
+
+  if color not in (0, 1, 2):
+    return {field: {'$in': []}}
+
+  if banding == 'quantiles':
+    bands = [{field: {'$lt': low}}, {field: {'$gte': low, '$lt': high}}, {field: {'$gte': high}}]
+  else:
+    bands = [{'$or': [{field: {'$lte': low}}, {field: high}]}, {field: {'$gt': low, '$lt': high}}, {field: {'$gt': high}}]
+
+  return bands[color]
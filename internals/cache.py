@@ -0,0 +1,59 @@
+import math
+import time
+from collections import OrderedDict
+
+caches = {}
+
+class LRUCache():
+  # In-process LRU cache with a per-entry time to live, registered by name so its counters can be exposed
+  def __init__(self, name: str, maxsize: int, ttl: float):
+    self.name = name
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.data = OrderedDict()
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+    caches[name] = self
+
+  def get(self, key, default=None):
+    entry = self.data.get(key)
+
+    if entry is None or entry[0] < time.monotonic():
+      if entry is not None:
+        del self.data[key]
+      self.misses += 1
+      return default
+
+    self.data.move_to_end(key)
+    self.hits += 1
+    return entry[1]
+
+  def set(self, key, value):
+    self.data[key] = (time.monotonic() + self.ttl, value)
+    self.data.move_to_end(key)
+
+    while len(self.data) > self.maxsize:
+      self.data.popitem(last=False)
+      self.evictions += 1
+
+  def invalidate(self, key):
+    self.data.pop(key, None)
+
+  def clear(self):
+    self.data.clear()
+
+  def stats(self) -> dict:
+    lookups = self.hits + self.misses
+
+    return {
+      'size': len(self.data),
+      'maxsize': self.maxsize,
+      'ttl': self.ttl if math.isfinite(self.ttl) else None,
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+      'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+    }
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import time
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from internals.cache import LRUCache
+
+load_dotenv()
+
+COUNTERS_RECONCILE_INTERVAL = float(os.getenv('COUNTERS_RECONCILE_INTERVAL', 3600))
+SIMULATIONS_STATS_CACHE_TTL = float(os.getenv('SIMULATIONS_STATS_CACHE_TTL', 10))
+COUNTERS_RECONCILE_BATCH_SIZE = int(os.getenv('COUNTERS_RECONCILE_BATCH_SIZE', 1000))
+
+# Yearly counters served by GET /simulations/, keyed by year
+simulations_stats_cache = LRUCache("simulations_stats", 4, SIMULATIONS_STATS_CACHE_TTL)
+
+_reconcile_job = None
+
+def counter_keys(created_at: int) -> list:
+  # Buckets follow the server local time, like the original "created_at >= Jan 1" range
+  day = time.localtime(created_at)
+
+  return [
+    ("year:%04d" % day.tm_year, {"period": "year", "year": day.tm_year}),
+    ("day:%s" % time.strftime("%Y-%m-%d", day), {"period": "day", "year": day.tm_year}),
+  ]
+
+async def increment_counters(_db, created_at: int, simulations_count: int = 0, simulations_maps_count: int = 0):
+  await _db["counters"].bulk_write([
+    UpdateOne(
+      {"_id": key},
+      {"$inc": {"simulations_count": simulations_count, "simulations_maps_count": simulations_maps_count}, "$setOnInsert": fields},
+      upsert=True,
+    )
+    for key, fields in counter_keys(created_at)
+  ], ordered=False)
+
+async def read_year_counters(_db, year: int) -> dict:
+  stats = simulations_stats_cache.get(year)
+
+  if stats is None:
+    counter = await _db["counters"].find_one({"_id": "year:%04d" % year}) or {}
+
+    stats = {"simulations_count": counter.get("simulations_count", 0), "simulations_maps_count": counter.get("simulations_maps_count", 0)}
+    simulations_stats_cache.set(year, stats)
+
+  return stats
+
+async def count_simulations(_db, simulations: list, counters: dict):
+  # Maps share the created_at of their simulation, so they are counted per simulation through the simulation_id index,
+  # a deduplicated map standing for its multiplicity
+  simulations_maps_counts = await _db["simulations_maps"].aggregate([
+    {"$match": {"simulation_id": {"$in": [ObjectId(simulation['_id']) for simulation in simulations]}}},
+    {"$group": {"_id": "$simulation_id", "count": {"$sum": {"$ifNull": ["$multiplicity", 1]}}}},
+  ]).to_list(None)
+  simulations_maps_counts = {str(item['_id']): item['count'] for item in simulations_maps_counts}
+
+  for simulation in simulations:
+    for key, fields in counter_keys(simulation['created_at']):
+      counter = counters.setdefault(key, dict(fields, simulations_count=0, simulations_maps_count=0))
+      counter['simulations_count'] += 1
+      counter['simulations_maps_count'] += simulations_maps_counts.get(str(simulation['_id']), 0)
+
+async def reconcile_counters(_db, year: int):
+  start = int(time.mktime((year, 1, 1, 0, 0, 0, 0, 0, -1)))
+  end = int(time.mktime((year + 1, 1, 1, 0, 0, 0, 0, 0, -1)))
+
+  # The year is walked in bounded batches, only the (at most 367) counters are kept in memory
+  counters = {}
+  simulations = []
+  async for simulation in _db["simulations"].find({"created_at": {"$gte": start, "$lt": end}}, {"created_at": 1}).batch_size(COUNTERS_RECONCILE_BATCH_SIZE):
+    simulations.append(simulation)
+
+    if len(simulations) >= COUNTERS_RECONCILE_BATCH_SIZE:
+      await count_simulations(_db, simulations, counters)
+      simulations = []
+
+  if simulations:
+    await count_simulations(_db, simulations, counters)
+
+  if counters:
+    await _db["counters"].bulk_write([UpdateOne({"_id": key}, {"$set": counter}, upsert=True) for key, counter in counters.items()], ordered=False)
+  await _db["counters"].delete_many({"year": year, "_id": {"$nin": list(counters)}})
+
+  simulations_stats_cache.invalidate(year)
+
+async def reconcile_counters_periodically(_db):
+  # Increments racing with a reconciliation may be overwritten, the next run fixes them
+  while True:
+    await reconcile_counters(_db, time.localtime().tm_year)
+    await asyncio.sleep(COUNTERS_RECONCILE_INTERVAL)
+
+def start_counters_job(_db):
+  global _reconcile_job
+
+  if COUNTERS_RECONCILE_INTERVAL > 0:
+    _reconcile_job = asyncio.create_task(reconcile_counters_periodically(_db))
+
+def cancel_counters_job():
+  if _reconcile_job is not None:
+    _reconcile_job.cancel()
@@ -0,0 +1,101 @@
+from dependencies.utils import pack_adjacency_matrix
+
+try:
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+except ImportError:
+  pa = None
+  pq = None
+
+METRICS_COLUMNS = [
+  ("_id", "string"),
+  ("simulation_id", "string"),
+  ("nodes_count", "int32"),
+  ("edges_count", "int32"),
+  ("entropy", "float64"),
+  ("entropy_percent", "float64"),
+  ("effort", "float64"),
+  ("color_entropy", "int8"),
+  ("color_entropy_percent", "int8"),
+  ("color_effort", "int8"),
+  ("created_at", "int64"),
+  ("canonical_hash", "string"),
+  ("multiplicity", "int64"),
+]
+
+class ChunkSink():
+  # Write-only file object handed to the Arrow writers, drained after every record batch
+  closed = False
+
+  def __init__(self):
+    self.chunks = []
+    self.position = 0
+
+  def write(self, data) -> int:
+    self.chunks.append(bytes(data))
+    self.position += len(data)
+    return len(data)
+
+  def tell(self) -> int:
+    return self.position
+
+  def flush(self):
+    pass
+
+  def close(self):
+    self.closed = True
+
+  def drain(self) -> bytes:
+    data = b"".join(self.chunks)
+    self.chunks = []
+    return data
+
+def simulation_maps_schema(matrices: bool):
+  fields = [pa.field(name, getattr(pa, type_name)()) for name, type_name in METRICS_COLUMNS]
+
+  # Matrices stay bit-packed: nodes_count x nodes_count bits, row-major, most significant bit first
+  if matrices:
+    fields.append(pa.field("adjacency_matrix", pa.binary()))
+
+  return pa.schema(fields)
+
+def simulation_maps_record_batch(simulation_maps: list, schema):
+  columns = {name: [simulation_map.get(name) for simulation_map in simulation_maps] for name, _ in METRICS_COLUMNS}
+  columns["_id"] = [str(value) for value in columns["_id"]]
+  columns["simulation_id"] = [str(value) for value in columns["simulation_id"]]
+  columns["multiplicity"] = [1 if value is None else value for value in columns["multiplicity"]]
+
+  if "adjacency_matrix" in schema.names:
+    columns["adjacency_matrix"] = [
+      simulation_map['adjacency_matrix'] if isinstance(simulation_map['adjacency_matrix'], bytes) else bytes(pack_adjacency_matrix([[int(value) for value in row] for row in simulation_map['adjacency_matrix']]))
+      for simulation_map in simulation_maps
+    ]
+
+  return pa.RecordBatch.from_pydict(columns, schema=schema)
+
+async def export_simulation_maps_columnar(cursor, format: str, batch_size: int, matrices: bool):
+  schema = simulation_maps_schema(matrices)
+  sink = ChunkSink()
+
+  if format == "parquet":
+    writer = pq.ParquetWriter(sink, schema)
+    write = writer.write_batch
+  else:
+    writer = pa.ipc.new_stream(sink, schema)
+    write = writer.write_batch
+
+  simulation_maps = []
+  async for simulation_map in cursor:
+    simulation_maps.append(simulation_map)
+
+    # One record batch (one Parquet row group) per cursor batch
+    if len(simulation_maps) >= batch_size:
+      write(simulation_maps_record_batch(simulation_maps, schema))
+      simulation_maps = []
+      yield sink.drain()
+
+  if simulation_maps:
+    write(simulation_maps_record_batch(simulation_maps, schema))
+
+  writer.close()
+  yield sink.drain()
@@ -0,0 +1,99 @@
+import os
+import logging
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import ASCENDING, IndexModel
+
+load_dotenv()
+
+INDEX_DIAGNOSTICS = os.getenv('INDEX_DIAGNOSTICS', 'false').lower() in ('1', 'true', 'yes')
+
+logger = logging.getLogger(__name__)
+
+# Every index the routers rely on, ensured at startup: (collection, keys)
+INDEXES = [
+  ("users", [("username", ASCENDING)]),
+  ("users", [("email", ASCENDING)]),
+  ("simulations", [("name", ASCENDING)]),
+  ("simulations", [("created_at", ASCENDING)]),
+  ("simulations_maps", [("simulation_id", ASCENDING), ("_id", ASCENDING)]),
+  ("simulations_maps", [("simulation_id", ASCENDING), ("entropy", ASCENDING), ("_id", ASCENDING)]),
+  ("simulations_maps", [("simulation_id", ASCENDING), ("entropy_percent", ASCENDING), ("_id", ASCENDING)]),
+  ("simulations_maps", [("simulation_id", ASCENDING), ("effort", ASCENDING), ("_id", ASCENDING)]),
+  ("simulations_maps", [("simulation_id", ASCENDING), ("canonical_hash", ASCENDING)]),
+  ("classrooms", [("invite_token", ASCENDING)]),
+  ("classrooms", [("teacher_id", ASCENDING), ("name", ASCENDING)]),
+  ("classrooms_students", [("classroom_id", ASCENDING), ("student_id", ASCENDING)]),
+  ("classrooms_students", [("student_id", ASCENDING)]),
+  ("classrooms_homeworks", [("classroom_id", ASCENDING), ("expire_datetime", ASCENDING)]),
+  ("classrooms_homeworks_maps", [("homework_id", ASCENDING), ("student_id", ASCENDING)]),
+]
+
+# Representative router lookups checked by the diagnostic mode: (collection, filter, sort)
+_sample_id = ObjectId()
+QUERIES = [
+  ("users", {"username": ""}, None),
+  ("users", {"email": ""}, None),
+  ("simulations", {"name": ""}, None),
+  ("simulations", {"created_at": {"$gte": 0, "$lt": 0}}, None),
+  ("simulations_maps", {"simulation_id": _sample_id}, [("_id", ASCENDING)]),
+  ("simulations_maps", {"simulation_id": _sample_id, "entropy": {"$gte": 0}}, [("entropy", ASCENDING), ("_id", ASCENDING)]),
+  ("simulations_maps", {"simulation_id": _sample_id}, [("entropy_percent", ASCENDING), ("_id", ASCENDING)]),
+  ("simulations_maps", {"simulation_id": _sample_id}, [("effort", ASCENDING), ("_id", ASCENDING)]),
+  ("simulations_maps", {"simulation_id": _sample_id, "canonical_hash": ""}, None),
+  ("classrooms", {"invite_token": ""}, None),
+  ("classrooms", {"teacher_id": _sample_id}, None),
+  ("classrooms", {"teacher_id": _sample_id, "name": ""}, None),
+  ("classrooms_students", {"classroom_id": _sample_id, "student_id": _sample_id}, None),
+  ("classrooms_students", {"classroom_id": _sample_id}, None),
+  ("classrooms_students", {"student_id": _sample_id}, None),
+  ("classrooms_homeworks", {"classroom_id": {"$in": [_sample_id]}, "expire_datetime": {"$gte": 0}}, None),
+  ("classrooms_homeworks_maps", {"homework_id": _sample_id, "student_id": _sample_id}, None),
+  ("classrooms_homeworks_maps", {"homework_id": {"$in": [_sample_id]}}, None),
+]
+
+async def ensure_indexes(_db):
+  models = {}
+  for collection, keys in INDEXES:
+    models.setdefault(collection, []).append(IndexModel(keys))
+
+  # createIndexes is a no-op for indexes that already exist with the same keys
+  for collection, indexes in models.items():
+    await _db[collection].create_indexes(indexes)
+
+def plan_stages(plan) -> list:
+  if isinstance(plan, list):
+    return [stage for item in plan for stage in plan_stages(item)]
+
+  if not isinstance(plan, dict):
+    return []
+
+  stages = [plan['stage']] if 'stage' in plan else []
+  for value in plan.values():
+    stages += plan_stages(value)
+
+  return stages
+
+async def explain_queries(_db) -> list:
+  results = []
+
+  for collection, query, sort in QUERIES:
+    cursor = _db[collection].find(query)
+    if sort:
+      cursor = cursor.sort(sort)
+
+    explain = await cursor.explain()
+    stages = plan_stages(explain.get('queryPlanner', {}).get('winningPlan', {}))
+
+    results.append({
+      "collection": collection,
+      "query": str(query),
+      "sort": sort,
+      "stages": stages,
+      "collscan": "COLLSCAN" in stages,
+    })
+
+    if "COLLSCAN" in stages:
+      logger.warning("COLLSCAN on %s for %s sorted by %s", collection, query, sort)
+
+  return results
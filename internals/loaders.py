@@ -0,0 +1,51 @@
+import asyncio
+from bson import ObjectId
+
+from db import get_db
+
+class UserLoader():
+  # Request-scoped loader: every users lookup made in the same event-loop tick
+  # is coalesced into a single $in query, and repeated ids are fetched once
+  def __init__(self, _db, projection: dict | None = None):
+    self._db = _db
+    self.projection = projection if projection is not None else {"password": 0}
+    self.futures = {}
+    self.queue = []
+
+  def load(self, user_id) -> asyncio.Future:
+    user_id = ObjectId(user_id)
+
+    if user_id in self.futures:
+      return self.futures[user_id]
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    self.futures[user_id] = future
+
+    if not self.queue:
+      loop.call_soon(self.dispatch)
+    self.queue.append(user_id)
+
+    return future
+
+  def load_many(self, users_ids) -> asyncio.Future:
+    return asyncio.gather(*[self.load(user_id) for user_id in users_ids])
+
+  def dispatch(self):
+    users_ids, self.queue = self.queue, []
+    asyncio.ensure_future(self.fetch(users_ids))
+
+  async def fetch(self, users_ids: list):
+    try:
+      users = await self._db["users"].find({"_id": {"$in": users_ids}}, self.projection).to_list(None)
+    except Exception as e:
+      for user_id in users_ids:
+        self.futures.pop(user_id).set_exception(e)
+      return
+
+    users = {user['_id']: user for user in users}
+    for user_id in users_ids:
+      self.futures[user_id].set_result(users.get(user_id))
+
+async def get_user_loader() -> UserLoader:
+  return UserLoader(await get_db())
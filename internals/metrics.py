@@ -0,0 +1,180 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from pymongo import monitoring
+
+load_dotenv()
+
+SLOW_REQUEST_THRESHOLD_MS = float(os.getenv('SLOW_REQUEST_THRESHOLD_MS', 500))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+logger = logging.getLogger(__name__)
+
+class RequestMetrics():
+  def __init__(self):
+    self.db_commands = 0
+    self.db_time = 0.0
+    self.serialization_time = 0.0
+
+# Motor copies the context into its executor threads, so the command listener sees the request being served
+_request_metrics = contextvars.ContextVar("request_metrics", default=None)
+
+_lock = threading.Lock()
+_routes = {}
+_commands = {}
+
+class CommandMetricsListener(monitoring.CommandListener):
+  def started(self, event):
+    pass
+
+  def succeeded(self, event):
+    record_command(event.command_name, event.duration_micros / 1e6)
+
+  def failed(self, event):
+    record_command(event.command_name, event.duration_micros / 1e6)
+
+command_metrics = CommandMetricsListener()
+
+def record_command(command_name: str, duration: float):
+  request_metrics = _request_metrics.get()
+
+  with _lock:
+    command = _commands.setdefault(command_name, {"count": 0, "time": 0.0})
+    command["count"] += 1
+    command["time"] += duration
+
+    if request_metrics is not None:
+      request_metrics.db_commands += 1
+      request_metrics.db_time += duration
+
+def record_serialization(duration: float):
+  request_metrics = _request_metrics.get()
+
+  if request_metrics is not None:
+    request_metrics.serialization_time += duration
+
+def record_request(method: str, route: str, status_code: int, duration: float, request_metrics: RequestMetrics):
+  with _lock:
+    metrics = _routes.setdefault((method, route), {
+      "buckets": [0] * len(LATENCY_BUCKETS),
+      "count": 0,
+      "sum": 0.0,
+      "statuses": {},
+      "db_commands": 0,
+      "db_time": 0.0,
+      "serialization_time": 0.0,
+    })
+
+    for idx, bucket in enumerate(LATENCY_BUCKETS):
+      if duration <= bucket:
+        metrics["buckets"][idx] += 1
+
+    metrics["count"] += 1
+    metrics["sum"] += duration
+    metrics["statuses"][status_code] = metrics["statuses"].get(status_code, 0) + 1
+    metrics["db_commands"] += request_metrics.db_commands
+    metrics["db_time"] += request_metrics.db_time
+    metrics["serialization_time"] += request_metrics.serialization_time
+
+def requests_totals() -> dict:
+  with _lock:
+    return {
+      "requests": sum(metrics["count"] for metrics in _routes.values()),
+      "db_commands": sum(metrics["db_commands"] for metrics in _routes.values()),
+    }
+
+def route_template(app, endpoint) -> str:
+  # Label by path template rather than raw path, so /simulations/{name} stays a single series
+  for route in getattr(app, "routes", []):
+    if getattr(route, "endpoint", None) is endpoint:
+      return route.path
+
+  return "unmatched"
+
+class MetricsMiddleware():
+  def __init__(self, app):
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http":
+      return await self.app(scope, receive, send)
+
+    request_metrics = RequestMetrics()
+    token = _request_metrics.set(request_metrics)
+    status_code = 500
+    start = time.perf_counter()
+
+    async def send_wrapper(message):
+      nonlocal status_code
+      if message["type"] == "http.response.start":
+        status_code = message["status"]
+      await send(message)
+
+    try:
+      await self.app(scope, receive, send_wrapper)
+    finally:
+      duration = time.perf_counter() - start
+      _request_metrics.reset(token)
+
+      # The router stores the matched endpoint in the scope it was handed
+      route = route_template(scope.get("app"), scope.get("endpoint"))
+      record_request(scope["method"], route, status_code, duration, request_metrics)
+
+      if duration * 1000 >= SLOW_REQUEST_THRESHOLD_MS:
+        logger.warning(
+          "Slow request %s %s (%s): %.1f ms total, %d MongoDB commands in %.1f ms, %.1f ms serializing",
+          scope["method"], scope["path"], route, duration * 1000,
+          request_metrics.db_commands, request_metrics.db_time * 1000, request_metrics.serialization_time * 1000,
+        )
+
+def prometheus_labels(**labels) -> str:
+  return ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in labels.items())
+
+def render_metrics() -> str:
+  lines = []
+
+  with _lock:
+    routes = sorted(_routes.items())
+    commands = sorted(_commands.items())
+
+    lines.append("# HELP http_request_duration_seconds Request latency by route")
+    lines.append("# TYPE http_request_duration_seconds histogram")
+    for (method, route), metrics in routes:
+      labels = prometheus_labels(method=method, route=route)
+      for bucket, count in zip(LATENCY_BUCKETS, metrics["buckets"]):
+        lines.append('http_request_duration_seconds_bucket{%s,le="%s"} %d' % (labels, bucket, count))
+      lines.append('http_request_duration_seconds_bucket{%s,le="+Inf"} %d' % (labels, metrics["count"]))
+      lines.append("http_request_duration_seconds_sum{%s} %f" % (labels, metrics["sum"]))
+      lines.append("http_request_duration_seconds_count{%s} %d" % (labels, metrics["count"]))
+
+    lines.append("# HELP http_requests_total Requests by route and status code")
+    lines.append("# TYPE http_requests_total counter")
+    for (method, route), metrics in routes:
+      for status_code, count in sorted(metrics["statuses"].items()):
+        lines.append("http_requests_total{%s} %d" % (prometheus_labels(method=method, route=route, status=status_code), count))
+
+    for name, key, kind, description in (
+      ("http_request_mongodb_commands_total", "db_commands", "%d", "MongoDB commands issued while serving the route"),
+      ("http_request_mongodb_seconds_total", "db_time", "%f", "Time spent in MongoDB commands while serving the route"),
+      ("http_request_serialization_seconds_total", "serialization_time", "%f", "Time spent encoding response bodies"),
+    ):
+      lines.append("# HELP %s %s" % (name, description))
+      lines.append("# TYPE %s counter" % name)
+      for (method, route), metrics in routes:
+        lines.append(("%s{%s} " + kind) % (name, prometheus_labels(method=method, route=route), metrics[key]))
+
+    lines.append("# HELP mongodb_commands_total MongoDB commands by name, background jobs included")
+    lines.append("# TYPE mongodb_commands_total counter")
+    for command_name, command in commands:
+      lines.append("mongodb_commands_total{%s} %d" % (prometheus_labels(command=command_name), command["count"]))
+
+    lines.append("# HELP mongodb_command_seconds_total Time spent in MongoDB commands by name")
+    lines.append("# TYPE mongodb_command_seconds_total counter")
+    for command_name, command in commands:
+      lines.append("mongodb_command_seconds_total{%s} %f" % (prometheus_labels(command=command_name), command["time"]))
+
+  return "\n".join(lines) + "\n"
@@ -0,0 +1,112 @@
+import os
+from dotenv import load_dotenv
+
+import numpy as np
+from pymongo import UpdateOne
+
+from dependencies.hashing import canonical_hashes, score_keys
+from dependencies.scoring import pad_adjacency_matrices, score_batch
+from internals.cache import LRUCache, caches
+
+load_dotenv()
+
+SCORES_CACHE_SIZE = int(os.getenv('SCORES_CACHE_SIZE', 100000))
+SCORES_CACHE_MONGODB = os.getenv('SCORES_CACHE_MONGODB', 'false').lower() in ('1', 'true', 'yes')
+
+# Content-addressed scores, keyed by canonical hash, nodes count and edges count, used by homework scoring in the server
+# process. Simulation workers do not share it: each spawned worker holds its own LRU and never reads the MongoDB tier,
+# only their hit and miss counts are folded into this one as chunks come back
+scores_cache = LRUCache("scores", SCORES_CACHE_SIZE, float('inf'))
+
+class MongoDBScoresTier():
+  # Optional second tier in the "scores" collection, shared by every server process
+  def __init__(self, name: str, enabled: bool):
+    self.enabled = enabled
+    self.hits = 0
+    self.misses = 0
+
+    caches[name] = self
+
+  async def get(self, _db, key: str):
+    scores = await _db["scores"].find_one({"_id": key})
+
+    if scores is None:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    return (scores['entropy'], scores['entropy_percent'], scores['effort'])
+
+  async def set(self, _db, key: str, scores: tuple):
+    await _db["scores"].update_one({"_id": key}, {"$setOnInsert": {"entropy": scores[0], "entropy_percent": scores[1], "effort": scores[2]}}, upsert=True)
+
+  async def set_many(self, _db, scores: dict):
+    await _db["scores"].bulk_write([
+      UpdateOne({"_id": key}, {"$setOnInsert": {"entropy": value[0], "entropy_percent": value[1], "effort": value[2]}}, upsert=True)
+      for key, value in scores.items()
+    ], ordered=False)
+
+  def stats(self) -> dict:
+    lookups = self.hits + self.misses
+
+    return {
+      "enabled": self.enabled,
+      "hits": self.hits,
+      "misses": self.misses,
+      "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+    }
+
+scores_mongodb = MongoDBScoresTier("scores_mongodb", SCORES_CACHE_MONGODB)
+
+def record_worker_stats(hits: int, misses: int):
+  scores_cache.hits += hits
+  scores_cache.misses += misses
+
+async def publish_chunk_scores(_db, chunk: dict):
+  # The MongoDB tier is how simulation scores reach homework scoring, in this process or another one
+  if not scores_mongodb.enabled:
+    return
+
+  keys = score_keys(chunk['canonical_hashes'], chunk['nodes_counts'], chunk['edges_counts'])
+
+  scores = {}
+  for idx, key in enumerate(keys):
+    if key not in scores:
+      scores[key] = (float(chunk['entropy'][idx]), float(chunk['entropy_percent'][idx]), float(chunk['effort'][idx]))
+
+  if scores:
+    await scores_mongodb.set_many(_db, scores)
+
+def normalize_adjacency_matrix(adjacency_matrix) -> np.ndarray:
+  # Submitted matrices may hold anything: keep the 1 links only, padded to a square matrix
+  adjacency_matrix = pad_adjacency_matrices([adjacency_matrix])[0][0]
+
+  size = max(adjacency_matrix.shape)
+  square = np.zeros((1, size, size), dtype=np.uint8)
+  square[0, :adjacency_matrix.shape[0], :adjacency_matrix.shape[1]] = adjacency_matrix
+  return square
+
+async def score_map(_db, adjacency_matrix, nodes_count: int, edges_count: int) -> dict:
+  adjacency_matrix = normalize_adjacency_matrix(adjacency_matrix)
+  key = score_keys(canonical_hashes(adjacency_matrix, [adjacency_matrix.shape[1]]), [nodes_count], [edges_count])[0]
+
+  scores = scores_cache.get(key)
+
+  if scores is None and scores_mongodb.enabled:
+    scores = await scores_mongodb.get(_db, key)
+    if scores is not None:
+      scores_cache.set(key, scores)
+
+  if scores is None:
+    computed = score_batch(adjacency_matrix, [nodes_count], [edges_count])
+    scores = (float(computed['entropy'][0]), float(computed['entropy_percent'][0]), float(computed['effort'][0]))
+
+    scores_cache.set(key, scores)
+    if scores_mongodb.enabled:
+      await scores_mongodb.set(_db, key, scores)
+
+  return {
+    'entropy': scores[0],
+    'entropy_percent': scores[1],
+    'effort': scores[2],
+  }
@@ -0,0 +1,278 @@
+import asyncio
+import collections
+import itertools
+import multiprocessing
+import os
+import time
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+
+import numpy as np
+
+from dependencies.hashing import format_hash
+from dependencies.utils import MAP_SCHEMA_VERSION, generate_concept_maps, pack_adjacency_matrix
+from internals.banding import BANDED_FIELDS, stored_quantiles, stored_range
+from internals.counters import increment_counters
+from internals.scores import publish_chunk_scores, record_worker_stats, scores_cache
+
+load_dotenv()
+
+SIMULATION_WORKERS = int(os.getenv('SIMULATION_WORKERS', os.cpu_count() or 1))
+SIMULATION_CHUNK_SIZE = int(os.getenv('SIMULATION_CHUNK_SIZE', 2000))
+SIMULATION_CHUNK_BYTES = int(os.getenv('SIMULATION_CHUNK_BYTES', 64 * 1024 * 1024))
+SIMULATION_PREFETCH_CHUNKS = int(os.getenv('SIMULATION_PREFETCH_CHUNKS', SIMULATION_WORKERS * 2))
+SIMULATION_WRITE_BATCH_SIZE = int(os.getenv('SIMULATION_WRITE_BATCH_SIZE', 1000))
+SIMULATION_WRITE_CONCURRENCY = int(os.getenv('SIMULATION_WRITE_CONCURRENCY', 4))
+SIMULATION_STALE_AFTER = float(os.getenv('SIMULATION_STALE_AFTER', 600))
+
+_executor = None
+_jobs = set()
+
+def get_executor() -> ProcessPoolExecutor:
+  global _executor
+
+  if _executor is None:
+    # Spawned workers do not inherit the event loop nor the MongoDB client threads of the server
+    _executor = ProcessPoolExecutor(max_workers=SIMULATION_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+  return _executor
+
+def shutdown_executor():
+  global _executor
+
+  if _executor is not None:
+    _executor.shutdown(cancel_futures=True)
+    _executor = None
+
+def generate_chunk(node_min: int, node_max: int, count: int, seed: np.random.SeedSequence, dedupe: bool = False) -> dict:
+  # Runs in a worker process: the scores cache is the worker's own LRU, kept across its chunks and simulations.
+  # It is not shared with the server nor with the other workers
+  hits, misses = scores_cache.hits, scores_cache.misses
+  chunk = generate_concept_maps(node_min, node_max, count, rng=np.random.default_rng(seed), dedupe=dedupe, scores_cache=scores_cache)
+
+  chunk['scores_cache_hits'] = scores_cache.hits - hits
+  chunk['scores_cache_misses'] = scores_cache.misses - misses
+
+  # Only the bit-packed matrices travel back to the server, not the dense padded batch
+  adjacency_matrices = chunk.pop('adjacency_matrices')
+  chunk['packed_matrices'] = [pack_adjacency_matrix(adjacency_matrices[idx, :nodes_count, :nodes_count]) for idx, nodes_count in enumerate(chunk['nodes_counts'].tolist())]
+  return chunk
+
+def split_chunks(maps_count: int, chunk_size: int = SIMULATION_CHUNK_SIZE) -> list:
+  return [min(chunk_size, maps_count - start) for start in range(0, maps_count, chunk_size)]
+
+def default_chunk_size(node_max: int) -> int:
+  # Workers hold a dense node_max x node_max batch per chunk, so big maps get smaller chunks
+  return max(min(SIMULATION_CHUNK_SIZE, SIMULATION_CHUNK_BYTES // max(node_max, 1) ** 2), 1)
+
+def simulation_chunk_size(simulation: dict) -> int:
+  # The chunk size is part of what the seed reproduces, simulations created before it was stored used the setting
+  return simulation.get('chunk_size', SIMULATION_CHUNK_SIZE)
+
+def chunk_seeds(seed: int, first_chunk: int, chunks_count: int) -> list:
+  # Same streams as SeedSequence(seed).spawn(), starting at the first chunk not generated yet
+  return [np.random.SeedSequence(seed, spawn_key=(idx,)) for idx in range(first_chunk, first_chunk + chunks_count)]
+
+async def iter_simulation_chunks(node_min: int, node_max: int, maps_count: int, seed: int, dedupe: bool = False, first_chunk: int = 0, chunk_size: int = SIMULATION_CHUNK_SIZE):
+  loop = asyncio.get_running_loop()
+  executor = get_executor()
+
+  # One independent, reproducible RNG stream per chunk
+  chunks = split_chunks(maps_count, chunk_size)
+  seeds = chunk_seeds(seed, first_chunk, len(chunks))
+
+  futures = collections.deque()
+  pending = iter(zip(chunks, seeds))
+
+  try:
+    # Keep a bounded window of chunks in flight and hand them out in order,
+    # so memory stays flat and the stored maps order is reproducible
+    for count, chunk_seed in itertools.islice(pending, max(SIMULATION_PREFETCH_CHUNKS, 1)):
+      futures.append(loop.run_in_executor(executor, generate_chunk, node_min, node_max, count, chunk_seed, dedupe))
+
+    while futures:
+      chunk = await futures.popleft()
+
+      for count, chunk_seed in itertools.islice(pending, 1):
+        futures.append(loop.run_in_executor(executor, generate_chunk, node_min, node_max, count, chunk_seed, dedupe))
+
+      yield chunk
+  finally:
+    for future in futures:
+      future.cancel()
+
+def simulation_map_documents(simulation: dict, chunk: dict) -> list:
+  entropy = chunk['entropy'].round(2).tolist()
+  entropy_percent = chunk['entropy_percent'].round(2).tolist()
+  effort = chunk['effort'].round(2).tolist()
+  edges_counts = chunk['edges_counts'].tolist()
+  multiplicities = chunk['multiplicities'].tolist()
+
+  # Ids are assigned here, in generation order, since batches may be written concurrently
+  data = []
+  for idx, nodes_count in enumerate(chunk['nodes_counts'].tolist()):
+    data.append({
+      '_id': ObjectId(),
+      'simulation_id': ObjectId(simulation['_id']),
+      'nodes_count': nodes_count,
+      'entropy': entropy[idx],
+      'entropy_percent': entropy_percent[idx],
+      'effort': effort[idx],
+      'edges_count': edges_counts[idx],
+      'created_at': simulation['created_at'],
+      'schema_version': MAP_SCHEMA_VERSION,
+      'canonical_hash': format_hash(chunk['canonical_hashes'][idx]),
+      'multiplicity': multiplicities[idx],
+      'adjacency_matrix': chunk['packed_matrices'][idx]
+    })
+
+  return data
+
+def simulation_map_operation(simulation: dict, document: dict):
+  if not simulation.get('dedupe'):
+    return InsertOne(document)
+
+  # A map already stored by a previous chunk only gets its multiplicity raised
+  document = dict(document)
+  multiplicity = document.pop('multiplicity')
+
+  return UpdateOne(
+    {'simulation_id': document['simulation_id'], 'canonical_hash': document['canonical_hash']},
+    {'$setOnInsert': document, '$inc': {'multiplicity': multiplicity}},
+    upsert=True,
+  )
+
+async def write_simulation_maps(_db, simulation: dict, data: list, write_slots: asyncio.Semaphore):
+  try:
+    maps_count = sum(document['multiplicity'] for document in data)
+
+    await _db["simulations_maps"].bulk_write([simulation_map_operation(simulation, document) for document in data], ordered=False)
+    await _db["simulations"].update_one({'_id': simulation['_id']}, {'$inc': {'maps_done': maps_count}, '$set': {'heartbeat_at': time.time()}})
+    await increment_counters(_db, simulation['created_at'], simulations_maps_count=maps_count)
+  finally:
+    write_slots.release()
+
+async def end_failed_run(_db, simulation: dict, status: str, error: str, extension: bool):
+  fields = {'status': status, 'error': {'$literal': error}, 'finished_at': time.time()}
+
+  # A failed extension gives the maps it did not generate back, its chunks stay consumed so a retry gets fresh streams
+  if extension:
+    fields['maps_count'] = '$maps_done'
+
+  await _db["simulations"].update_one({'_id': simulation['_id']}, [{'$set': fields}])
+
+async def run_simulation(_db, simulation: dict, maps_count: int | None = None, first_chunk: int = 0):
+  # An extension generates maps_count more maps, from the RNG stream of the first chunk not generated yet.
+  # It matches a direct generation of the total only when the previous maps count was a multiple of the chunk size,
+  # since a partial last chunk is not completed
+  extension = first_chunk > 0
+
+  if maps_count is None:
+    maps_count = simulation['maps_count']
+
+  # Colors are derived when serving from the stats kept on the simulation, so maps are written once as they are generated
+  if not extension:
+    ranges = {field: {'min': float('inf'), 'max': 0.0} for field in BANDED_FIELDS}
+  elif simulation.get('stats'):
+    ranges = {field: {'min': simulation['stats'][field]['min'], 'max': simulation['stats'][field]['max']} for field in BANDED_FIELDS}
+  else:
+    ranges = await stored_range(_db, simulation)
+
+  # Deduplicated batches are written one at a time, so an upsert always sees the maps of the previous chunks
+  write_slots = asyncio.Semaphore(1 if simulation.get('dedupe') else max(SIMULATION_WRITE_CONCURRENCY, 1))
+  writes = set()
+
+  try:
+    async for chunk in iter_simulation_chunks(simulation['node_min'], simulation['node_max'], maps_count, simulation['seed'], simulation.get('dedupe', False), first_chunk, simulation_chunk_size(simulation)):
+      record_worker_stats(chunk['scores_cache_hits'], chunk['scores_cache_misses'])
+      await publish_chunk_scores(_db, chunk)
+
+      for field in BANDED_FIELDS:
+        ranges[field]['min'] = min(ranges[field]['min'], float(chunk[field].min(initial=float('inf'))))
+        ranges[field]['max'] = max(ranges[field]['max'], float(chunk[field].max(initial=0)))
+
+      data = simulation_map_documents(simulation, chunk)
+
+      # Unordered bulk writes in bounded batches, at most SIMULATION_WRITE_CONCURRENCY in flight
+      for start in range(0, len(data), SIMULATION_WRITE_BATCH_SIZE):
+        await write_slots.acquire()
+
+        write = asyncio.create_task(write_simulation_maps(_db, simulation, data[start:start + SIMULATION_WRITE_BATCH_SIZE], write_slots))
+        writes.add(write)
+
+      # Surface a failed write as soon as possible: finished writes are only dropped once their result was checked
+      for write in [write for write in writes if write.done()]:
+        writes.discard(write)
+        write.result()
+
+    await asyncio.gather(*writes)
+
+    # Quantiles are read from the maps as stored once all of them are written, so the metrics are never held in memory
+    quantiles = await stored_quantiles(_db, simulation)
+    stats = {field: {'min': ranges[field]['min'] if ranges[field]['min'] != float('inf') else 0.0, 'max': ranges[field]['max'], 'quantiles': quantiles[field]} for field in BANDED_FIELDS}
+
+  except asyncio.CancelledError:
+    # Server shutdown or a cancelled request: the job will not resume, so it must not stay running
+    await end_failed_run(_db, simulation, 'cancelled', 'Simulation was cancelled', extension)
+    raise
+
+  except Exception as e:
+    await end_failed_run(_db, simulation, 'failed', str(e), extension)
+    raise
+
+  finally:
+    for write in writes:
+      write.cancel()
+
+  await _db["simulations"].update_one({'_id': simulation['_id']}, {'$set': {'status': 'completed', 'finished_at': time.time(), 'stats': stats}})
+
+def start_simulation_job(_db, simulation: dict, maps_count: int | None = None, first_chunk: int = 0) -> asyncio.Task:
+  task = asyncio.create_task(run_simulation(_db, simulation, maps_count, first_chunk))
+
+  # Keep a strong reference until the job is done
+  _jobs.add(task)
+  task.add_done_callback(_jobs.discard)
+  return task
+
+async def cancel_simulation_jobs():
+  jobs = list(_jobs)
+  for task in jobs:
+    task.cancel()
+
+  # Let the jobs record their cancelled status before the MongoDB client is closed
+  await asyncio.gather(*jobs, return_exceptions=True)
+
+async def recover_stale_simulations(_db):
+  # Jobs of a process that died without cancelling them stay running: fail the ones without progress for a while.
+  # Every batch written refreshes heartbeat_at, so the jobs of other live processes are left alone
+  await _db["simulations"].update_many(
+    {'status': 'running', 'heartbeat_at': {'$not': {'$gte': time.time() - SIMULATION_STALE_AFTER}}},
+    {'$set': {'status': 'failed', 'error': 'Simulation was interrupted', 'finished_at': time.time()}},
+  )
+
+def simulation_progress(simulation: dict) -> dict:
+  maps_count = simulation['maps_count']
+  maps_done = simulation.get('maps_done', maps_count)
+  status = simulation.get('status', 'completed')
+
+  started_at = simulation.get('started_at')
+  elapsed = (simulation.get('finished_at') or time.time()) - started_at if started_at else None
+
+  # Extensions start from the maps already done
+  maps_start = simulation.get('maps_start', 0)
+
+  eta = None
+  if status == 'running' and elapsed is not None and maps_done > maps_start:
+    eta = round(elapsed / (maps_done - maps_start) * (maps_count - maps_done), 2)
+
+  return {
+    'status': status,
+    'maps_count': maps_count,
+    'maps_done': maps_done,
+    'progress': round(maps_done / maps_count * 100, 2) if maps_count else 100,
+    'elapsed': round(elapsed, 2) if elapsed is not None else None,
+    'eta': eta,
+    'error': simulation.get('error'),
+  }
@@ -1,11 +1,25 @@
+import os
 from typing import Annotated
+from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, status
 from jose import JWTError, jwt
 from dependencies.models import TokenData, UserToken
 
 from internals.auth import ALGORITHM, SECRET_KEY, verify_password, oauth2_scheme, get_password_hash
+from internals.cache import LRUCache
 from db import get_db
 
+load_dotenv()
+
+PRINCIPALS_CACHE_SIZE = int(os.getenv('PRINCIPALS_CACHE_SIZE', 10000))
+PRINCIPALS_CACHE_TTL = float(os.getenv('PRINCIPALS_CACHE_TTL', 30))
+
+# Authenticated users by username, so that polling clients do not hit MongoDB on every request
+principals_cache = LRUCache("principals", PRINCIPALS_CACHE_SIZE, PRINCIPALS_CACHE_TTL)
+
+def invalidate_principal(username: str):
+  principals_cache.invalidate(username)
+
 async def get_user(username: str):
   _db = await get_db()
 
@@ -16,12 +30,11 @@ async def get_user(username: str):
 
 async def authenticate_user(username: str, password: str):
   user = await get_user(username)
-  print(user)
 
   if not user:
     return False
   
-  if not verify_password(password, user['password']):
+  if not await verify_password(password, user['password']):
     return False
 
   return user
@@ -43,12 +56,17 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
   except JWTError:
     raise credentials_exception
   
-  user = await get_user(username=token_data.username)
+  user = principals_cache.get(token_data.username)
 
   if user is None:
-    raise credentials_exception
+    user = await get_user(username=token_data.username)
+
+    if user is None:
+      raise credentials_exception
+
+    principals_cache.set(token_data.username, user)
   
-  return user
+  return dict(user)
 
 async def get_current_active_user(current_user: Annotated[UserToken, Depends(get_current_user)]):
   if current_user.get('is_disabled') is not None:
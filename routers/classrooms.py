@@ -1,16 +1,17 @@
+import asyncio
 import math
 from typing import Annotated
-from bson import ObjectId, json_util
+from bson import ObjectId
 from fastapi import APIRouter, Body, Depends, status, HTTPException
-from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
-import json
 import time
 import uuid 
 
 from db import get_db
+from dependencies.responses import BSONResponse
 from dependencies.models import Classroom, ClassroomHomework, ClassroomHomeworkMap, User
-from dependencies.utils import ConceptMap
+from internals.loaders import UserLoader, get_user_loader
+from internals.scores import score_map
 from internals.user import get_current_user
 import datetime
   
@@ -40,7 +41,38 @@ async def student_join_classrooms(invite_token: str, current_user: Annotated[Use
   new_classroom_student = await _db["classrooms_students"].insert_one({ 'classroom_id': ObjectId(classroom['_id']), 'student_id': ObjectId(current_user['_id']) })
   created_classroom_student = await _db["classrooms_students"].find_one({"_id": new_classroom_student.inserted_id})
 
-  return JSONResponse(status_code=status.HTTP_201_CREATED, content=json.loads(json_util.dumps(created_classroom_student)))
+  return BSONResponse(status_code=status.HTTP_201_CREATED, content=created_classroom_student)
+
+async def add_classrooms_summary(_db, classrooms: list) -> list:
+  classrooms_ids = [classroom['_id'] for classroom in classrooms]
+  teachers_ids = list({ObjectId(classroom['teacher_id']) for classroom in classrooms})
+
+  ct = datetime.datetime.now()
+  dt = ct.timestamp()
+
+  # A constant number of batched queries, whatever the number of classrooms
+  teachers, students_counts, homeworks_counts = await asyncio.gather(
+    _db["users"].find({"_id": {"$in": teachers_ids}}).to_list(None),
+    _db["classrooms_students"].aggregate([
+      {"$match": {"classroom_id": {"$in": classrooms_ids}}},
+      {"$group": {"_id": "$classroom_id", "count": {"$sum": 1}}},
+    ]).to_list(None),
+    _db["classrooms_homeworks"].aggregate([
+      {"$match": {"classroom_id": {"$in": classrooms_ids}, "expire_datetime": {"$gte": int(dt)}}},
+      {"$group": {"_id": "$classroom_id", "count": {"$sum": 1}}},
+    ]).to_list(None),
+  )
+
+  teachers = {teacher['_id']: teacher for teacher in teachers}
+  students_counts = {count['_id']: count['count'] for count in students_counts}
+  homeworks_counts = {count['_id']: count['count'] for count in homeworks_counts}
+
+  for classroom in classrooms:
+    classroom["teacher"] = teachers.get(ObjectId(classroom['teacher_id']))
+    classroom["students_count"] = students_counts.get(classroom['_id'], 0)
+    classroom["homeworks_count"] = homeworks_counts.get(classroom['_id'], 0)
+
+  return classrooms
 
 @router.get("/", response_description="Get all the classrooms")
 async def show_classrooms(current_user: Annotated[User, Depends(get_current_user)]):
@@ -50,49 +82,30 @@ async def show_classrooms(current_user: Annotated[User, Depends(get_current_user
   
     classrooms = await _db["classrooms"].find({"teacher_id": current_user['_id']}).to_list(None)
 
-    ct = datetime.datetime.now()
-    dt = ct.timestamp()
-    
     if classrooms:
-      for classroom in classrooms:
-        teacher = await _db["users"].find_one({"_id": classroom['teacher_id']})
-        classroom["teacher"] = teacher
-    
-        classroom_students_count = await _db["classrooms_students"].count_documents({"classroom_id": classroom['_id']})
-        classroom["students_count"] = classroom_students_count
-
-        classroom_homeworks_count = await _db["classrooms_homeworks"].count_documents({"classroom_id": classroom['_id'], "expire_datetime": {"$gte": int(dt)}})
-        classroom["homeworks_count"] = classroom_homeworks_count
+      await add_classrooms_summary(_db, classrooms)
           
-    return JSONResponse(status_code=status.HTTP_200_OK, content=json.loads(json_util.dumps(classrooms)))
+    return BSONResponse(status_code=status.HTTP_200_OK, content=classrooms)
   
   if current_user['role'] == 0:
     classrooms_student = await _db["classrooms_students"].find({"student_id": current_user['_id']}).to_list(None)
 
     classrooms = []
 
-    ct = datetime.datetime.now()
-    dt = ct.timestamp()
-
     if classrooms_student:
-      for classroom_student in classrooms_student:
-        classroom = await _db["classrooms"].find_one({"_id": classroom_student['classroom_id']})
-        teacher = await _db["users"].find_one({"_id": ObjectId(classroom['teacher_id'])})
-        classroom["teacher"] = teacher
-        print(classroom)
-
-        classroom_students_count = await _db["classrooms_students"].count_documents({"classroom_id": classroom['_id']})
-        classroom["students_count"] = classroom_students_count
+      classrooms_ids = [classroom_student['classroom_id'] for classroom_student in classrooms_student]
+      student_classrooms = await _db["classrooms"].find({"_id": {"$in": classrooms_ids}}).to_list(None)
+      student_classrooms = {classroom['_id']: classroom for classroom in student_classrooms}
 
-        classroom_homeworks_count = await _db["classrooms_homeworks"].count_documents({"classroom_id": classroom['_id'], "expire_datetime": {"$gte": int(dt)}})
-        classroom["homeworks_count"] = classroom_homeworks_count
+      # Keep the order in which the student joined the classrooms
+      classrooms = [student_classrooms[classroom_id] for classroom_id in classrooms_ids if classroom_id in student_classrooms]
 
-        classrooms.append(classroom)
+      await add_classrooms_summary(_db, classrooms)
 
-    return JSONResponse(status_code=status.HTTP_200_OK, content=json.loads(json_util.dumps(classrooms)))
+    return BSONResponse(status_code=status.HTTP_200_OK, content=classrooms)
 
 @router.get("/{id}", response_description="Show classroom")
-async def show_classroom(id: str, current_user: Annotated[User, Depends(get_current_user)]):
+async def show_classroom(id: str, current_user: Annotated[User, Depends(get_current_user)], user_loader: Annotated[UserLoader, Depends(get_user_loader)]):
   _db = await get_db()
 
   classroom = await _db["classrooms"].find_one({"_id": ObjectId(id)})
@@ -107,7 +120,7 @@ async def show_classroom(id: str, current_user: Annotated[User, Depends(get_curr
     if student_classroom == None:
       raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not allowed to see this classroom")
   
-  teacher = await _db["users"].find_one({'_id': classroom['teacher_id']})
+  teacher = await user_loader.load(classroom['teacher_id'])
 
   if teacher != None:
     classroom['teacher'] = {
@@ -116,11 +129,11 @@ async def show_classroom(id: str, current_user: Annotated[User, Depends(get_curr
       'email': teacher['email']
     }
 
-  return JSONResponse(status_code=status.HTTP_200_OK, content=json.loads(json_util.dumps(classroom)))
+  return BSONResponse(status_code=status.HTTP_200_OK, content=classroom)
 
 
 @router.get("/{id}/students", response_description="Show classroom students")
-async def show_classroom_students(id: str, current_user: Annotated[User, Depends(get_current_user)]):
+async def show_classroom_students(id: str, current_user: Annotated[User, Depends(get_current_user)], user_loader: Annotated[UserLoader, Depends(get_user_loader)]):
   _db = await get_db()
 
   classroom = await _db["classrooms"].find_one({"_id": ObjectId(id)})
@@ -137,9 +150,9 @@ async def show_classroom_students(id: str, current_user: Annotated[User, Depends
 
   is_valid_student = True if current_user['role'] == 1 else False
 
-  for classroom_student in classroom_students:
-    student = await _db["users"].find_one({'_id': classroom_student['student_id'] })
+  classroom_students_users = await user_loader.load_many([classroom_student['student_id'] for classroom_student in classroom_students])
 
+  for student in classroom_students_users:
     if student:
       if is_valid_student == False and student['_id'] == current_user['_id']:
         is_valid_student = True
@@ -153,7 +166,7 @@ async def show_classroom_students(id: str, current_user: Annotated[User, Depends
   if is_valid_student == False:
     raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not allowed to see this classroom")
   
-  return JSONResponse(status_code=status.HTTP_200_OK, content=json.loads(json_util.dumps(students)))
+  return BSONResponse(status_code=status.HTTP_200_OK, content=students)
 
 @router.get("/{id}/homeworks", response_description="Show classroom homeworks")
 async def show_classroom_homeworks(id: str, current_user: Annotated[User, Depends(get_current_user)]):
@@ -177,7 +190,7 @@ async def show_classroom_homeworks(id: str, current_user: Annotated[User, Depend
     homework_maps = await _db["classrooms_homeworks_maps"].find({'homework_id': homework['_id'] }).to_list(None)
     homework['maps'] = homework_maps
 
-  return JSONResponse(status_code=status.HTTP_200_OK, content=json.loads(json_util.dumps(homeworks)))
+  return BSONResponse(status_code=status.HTTP_200_OK, content=homeworks)
 
 @router.post("/", response_description="Add a new classroom")
 async def create_classroom(current_user: Annotated[User, Depends(get_current_user)], classroom: Classroom = Body(...)):
@@ -200,7 +213,7 @@ async def create_classroom(current_user: Annotated[User, Depends(get_current_use
   new_classroom = await _db["classrooms"].insert_one(classroom)
   created_classroom = await _db["classrooms"].find_one({"_id": new_classroom.inserted_id})
 
-  return JSONResponse(status_code=status.HTTP_201_CREATED, content=json.loads(json_util.dumps(created_classroom)))
+  return BSONResponse(status_code=status.HTTP_201_CREATED, content=created_classroom)
 
 
 @router.post("/{id}/homeworks", response_description="Add a new classroom homework")
@@ -227,11 +240,11 @@ async def create_classroom_homework(id: str, current_user: Annotated[User, Depen
   new_classroom_homework = await _db["classrooms_homeworks"].insert_one(classroom_homework)
   created_classroom_homework = await _db["classrooms_homeworks"].find_one({"_id": new_classroom_homework.inserted_id})
 
-  return JSONResponse(status_code=status.HTTP_201_CREATED, content=json.loads(json_util.dumps(created_classroom_homework)))
+  return BSONResponse(status_code=status.HTTP_201_CREATED, content=created_classroom_homework)
 
 
 @router.get("/{classroom_id}/homeworks/{homework_id}", response_description="Show classroom homeworks")
-async def show_classroom_homeworks(classroom_id: str, homework_id: str, current_user: Annotated[User, Depends(get_current_user)]):
+async def show_classroom_homeworks(classroom_id: str, homework_id: str, current_user: Annotated[User, Depends(get_current_user)], user_loader: Annotated[UserLoader, Depends(get_user_loader)]):
   _db = await get_db()
 
   classroom = await _db["classrooms"].find_one({"_id": ObjectId(classroom_id)})
@@ -260,14 +273,15 @@ async def show_classroom_homeworks(classroom_id: str, homework_id: str, current_
 
     homework['maps'] = []
 
-    for homework_map in homework_maps:
-      author = await _db["users"].find_one({'_id': ObjectId(homework_map['student_id'])})
+    authors = await user_loader.load_many([homework_map['student_id'] for homework_map in homework_maps])
+
+    for homework_map, author in zip(homework_maps, authors):
       homework_map['author_name'] = author['firstname'] + " " + author['lastname'] if author else ""
       homework_map['is_teacher_map'] = True if author['role'] == 1 else False
 
       homework['maps'].append(homework_map)
 
-  return JSONResponse(status_code=status.HTTP_200_OK, content=json.loads(json_util.dumps(homework)))
+  return BSONResponse(status_code=status.HTTP_200_OK, content=homework)
 
 @router.post("/{classroom_id}/homeworks/{homework_id}", response_description="Create classroom homework")
 async def create_classroom_homework_map(classroom_id: str, homework_id: str, current_user: Annotated[User, Depends(get_current_user)], classroom_homework_map: ClassroomHomeworkMap = Body(...)):
@@ -294,29 +308,16 @@ async def create_classroom_homework_map(classroom_id: str, homework_id: str, cur
   classroom_homework_map['student_id'] = current_user['_id']
   classroom_homework_map['created_at'] = int(time.time())
 
-  classroom_homework_map['entropy'] = 0
-  entropy_max = [0, 0, 0, 1,2.584962501,4.584962501,6.906890596,9.491853096,12.29920802,15.29920802,18.46913302,21.79106111,25.25049273,28.83545523,32.53589495,36.34324987,40.25014047,44.25014047,48.33760331,52.50752831,56.75545583,61.07738392,65.46970134,69.92913296,74.45269492,79.03765742,83.68151361,88.38195333,93.13684083,97.94419575,102.8021767]
-  for x in classroom_homework_map['adjacency_matrix']:
-    links_count = 0 
-    for y in x: # Check for every node how many links it has
-      if y == 1:
-        links_count = links_count + 1
-    
-    node_entropy = 0
-    if links_count > 0:
-      probability = 1 / links_count 
-      for _ in range(links_count):
-        node_entropy = node_entropy + abs((probability * math.log(probability, 2))) # Entropy formula
-
-    classroom_homework_map['entropy'] = classroom_homework_map['entropy'] + node_entropy
+  scores = await score_map(_db, classroom_homework_map['adjacency_matrix'], classroom_homework_map['nodes_count'], classroom_homework_map['edges_count'])
 
-  if classroom_homework_map['nodes_count'] >= 0 and classroom_homework_map['nodes_count'] <= 30:
-    classroom_homework_map['entropy_percent'] = (classroom_homework_map['entropy'] / entropy_max[classroom_homework_map['nodes_count']]) * 100
+  classroom_homework_map['entropy'] = scores['entropy']
 
-    classroom_homework_map['effort'] = (classroom_homework_map['entropy_percent'] / 100) * classroom_homework_map['nodes_count'] * classroom_homework_map['edges_count']
+  if not math.isnan(scores['entropy_percent']):
+    classroom_homework_map['entropy_percent'] = scores['entropy_percent']
+    classroom_homework_map['effort'] = scores['effort']
 
   new_classroom_homework_map = await _db["classrooms_homeworks_maps"].insert_one(classroom_homework_map)
   created_classroom_homework_map = await _db["classrooms_homeworks_maps"].find_one({"_id": new_classroom_homework_map.inserted_id})
   
-  return JSONResponse(status_code=status.HTTP_201_CREATED, content=json.loads(json_util.dumps(created_classroom_homework_map)))
+  return BSONResponse(status_code=status.HTTP_201_CREATED, content=created_classroom_homework_map)
 
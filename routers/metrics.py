@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from internals.metrics import render_metrics
+
+router = APIRouter(
+	tags=["metrics"],
+)
+
+@router.get("/metrics", response_class=PlainTextResponse, response_description="Prometheus metrics")
+async def show_metrics():
+	return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
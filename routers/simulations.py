@@ -1,18 +1,27 @@
-from typing import Annotated
+from typing import Annotated, Literal
 from bson import ObjectId
-from fastapi import APIRouter, Body, Depends, status, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Body, Depends, Query, status, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.encoders import jsonable_encoder
+from pymongo import ReturnDocument
+import asyncio
+import base64
+import csv
+import io
 import json
-import numpy as np
+import secrets
 import time
 
-from db import get_db
-from dependencies.models import Simulation, User
-from dependencies.utils import ConceptMap
+from db import get_db, get_read_db
+from dependencies.models import Simulation, SimulationMap, User
+from dependencies.responses import BSONResponse
+from dependencies.utils import unpack_adjacency_matrix
+from internals import export
+from internals.banding import band_query, band_simulation_maps, get_simulation_stats
+from internals.counters import increment_counters, read_year_counters
+from internals.simulation import default_chunk_size, run_simulation, simulation_chunk_size, simulation_progress, split_chunks, start_simulation_job
 from internals.user import get_current_user
 from datetime import date
-import datetime
 
 router = APIRouter(
 	prefix="/simulations",
@@ -24,17 +33,9 @@ router = APIRouter(
 async def read_simulations():
 	_db = await get_db()
 
+	return await read_year_counters(_db, date.today().year)
 
-	dt = int(time.mktime(datetime.datetime.strptime(str(date(date.today().year, 1, 1)), "%Y-%m-%d").timetuple()))
-
-	simulations_count = await _db["simulations"].count_documents({"created_at": {"$gte": dt}})
-	simulations_maps_count = await _db["simulations_maps"].count_documents({"created_at": {"$gte": dt}})
-	return {"simulations_count": simulations_count, "simulations_maps_count": simulations_maps_count}
-
-@router.get("/{name}", response_description="Get a single simulation", response_model=Simulation)
-async def show_simulation(name: str, current_user: Annotated[User, Depends(get_current_user)]):
-	_db = await get_db()
-
+async def get_visible_simulation(_db, name: str, current_user: dict) -> dict:
 	simulation = await _db["simulations"].find_one({"name": name})
 
 	if not simulation:
@@ -49,93 +50,380 @@ async def show_simulation(name: str, current_user: Annotated[User, Depends(get_c
       detail="You are not authorized to view this simulation",
     )
 
-	simulation_maps = await _db["simulations_maps"].find({"simulation_id": ObjectId(simulation['_id'])}).to_list(None)
+	return simulation
+
+# Map colors are not stored: they band each metric of the simulation by thirds of its maximum, or by its tertiles
+BANDING_SCHEMES = Literal["thirds", "quantiles"]
+
+@router.get("/{name}", response_description="Get a single simulation", response_model=Simulation)
+async def show_simulation(name: str, current_user: Annotated[User, Depends(get_current_user)], raw: bool = False, banding: BANDING_SCHEMES = "thirds"):
+	_db = await get_db()
+
+	simulation = await get_visible_simulation(_db, name, current_user)
+	stats = await get_simulation_stats(_db, simulation)
+	_read_db = await get_read_db()
+
+	simulation_maps = band_simulation_maps(await _read_db["simulations_maps"].find({"simulation_id": ObjectId(simulation['_id'])}).to_list(None), stats, banding)
+
+	# Serve bit-packed matrices as they are stored, base64 encoded, instead of decoding them
+	if raw:
+		for simulation_map in simulation_maps:
+			if isinstance(simulation_map['adjacency_matrix'], bytes):
+				simulation_map['adjacency_matrix'] = base64.b64encode(simulation_map['adjacency_matrix']).decode()
 
 	simulation['maps'] = simulation_maps
 
 	return simulation
 
+def encode_maps_cursor(simulation_map: dict, sort: str) -> str:
+	cursor = {"id": str(simulation_map['_id'])}
+	if sort != "_id":
+		cursor["value"] = simulation_map[sort]
+
+	return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+def decode_maps_cursor(cursor: str, sort: str) -> dict:
+	try:
+		cursor = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+		cursor_id = ObjectId(cursor["id"])
+		cursor_value = cursor["value"] if sort != "_id" else None
+	except (ValueError, KeyError, TypeError):
+		raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+	return {"id": cursor_id, "value": cursor_value}
+
+def serialize_simulation_map(simulation_map: dict, raw: bool = False) -> dict:
+	simulation_map['_id'] = str(simulation_map['_id'])
+
+	if 'simulation_id' in simulation_map:
+		simulation_map['simulation_id'] = str(simulation_map['simulation_id'])
+
+	adjacency_matrix = simulation_map.get('adjacency_matrix')
+	if isinstance(adjacency_matrix, bytes):
+		simulation_map['adjacency_matrix'] = base64.b64encode(adjacency_matrix).decode() if raw else unpack_adjacency_matrix(adjacency_matrix, simulation_map['nodes_count']).tolist()
+	elif adjacency_matrix is not None:
+		simulation_map['adjacency_matrix'] = [[int(value) for value in row] for row in adjacency_matrix]
+
+	return simulation_map
+
+MAPS_SORT_FIELDS = Literal["_id", "entropy", "entropy_percent", "effort", "nodes_count", "edges_count"]
+
+@router.get("/{name}/maps", response_description="Get a page of the simulation maps")
+async def show_simulation_maps(
+	name: str,
+	current_user: Annotated[User, Depends(get_current_user)],
+	limit: int = Query(100, ge=1, le=1000),
+	after: str | None = None,
+	sort: MAPS_SORT_FIELDS = "_id",
+	order: Literal["asc", "desc"] = "asc",
+	fields: str | None = None,
+	color_entropy: int | None = None,
+	color_entropy_percent: int | None = None,
+	color_effort: int | None = None,
+	min_entropy: float | None = None,
+	max_entropy: float | None = None,
+	min_entropy_percent: float | None = None,
+	max_entropy_percent: float | None = None,
+	min_effort: float | None = None,
+	max_effort: float | None = None,
+	raw: bool = False,
+	banding: BANDING_SCHEMES = "thirds",
+):
+	_db = await get_db()
+
+	simulation = await get_visible_simulation(_db, name, current_user)
+	stats = await get_simulation_stats(_db, simulation)
+	_read_db = await get_read_db()
+
+	query = {"simulation_id": ObjectId(simulation['_id'])}
+
+	for field, value in (("entropy", color_entropy), ("entropy_percent", color_entropy_percent), ("effort", color_effort)):
+		if value is not None:
+			query.setdefault("$and", []).append(band_query(field, value, stats, banding))
+
+	for field, min_value, max_value in (("entropy", min_entropy, max_entropy), ("entropy_percent", min_entropy_percent, max_entropy_percent), ("effort", min_effort, max_effort)):
+		if min_value is not None:
+			query.setdefault(field, {})["$gte"] = min_value
+		if max_value is not None:
+			query.setdefault(field, {})["$lte"] = max_value
+
+	# Keyset pagination on (sort, _id): resume strictly after the last map of the previous page
+	direction = 1 if order == "asc" else -1
+	operator = "$gt" if direction == 1 else "$lt"
+
+	if after is not None:
+		cursor = decode_maps_cursor(after, sort)
+
+		if sort == "_id":
+			query["_id"] = {operator: cursor["id"]}
+		else:
+			query["$or"] = [
+				{sort: {operator: cursor["value"]}},
+				{sort: cursor["value"], "_id": {operator: cursor["id"]}},
+			]
+
+	projection = None
+	hidden = set()
+	if fields:
+		requested = [field for field in fields.split(",") if field]
+		unknown = [field for field in requested if field not in SimulationMap.__fields__]
+
+		if unknown or not requested:
+			raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown fields: " + ",".join(unknown) if unknown else "No fields requested")
+
+		# _id is always returned, it also keeps the projection from being empty, which would return the whole documents
+		projection = {"_id": 1, **{field: 1 for field in requested if field != "id"}}
+		if sort != "_id":
+			projection[sort] = 1
+		if "adjacency_matrix" in projection:
+			projection["nodes_count"] = 1
+
+		# Colors are derived from their metric, fetched along and dropped again if it was not asked for
+		for field in ("entropy", "entropy_percent", "effort"):
+			if "color_" + field in projection:
+				projection.pop("color_" + field)
+				if field not in projection:
+					projection[field] = 1
+					hidden.add(field)
+			else:
+				hidden.add("color_" + field)
+
+	sort_keys = [("_id", direction)] if sort == "_id" else [(sort, direction), ("_id", direction)]
+
+	simulation_maps = band_simulation_maps(await _read_db["simulations_maps"].find(query, projection).sort(sort_keys).limit(limit).to_list(limit), stats, banding)
+
+	next_cursor = encode_maps_cursor(simulation_maps[-1], sort) if len(simulation_maps) == limit else None
+
+	for simulation_map in simulation_maps:
+		for field in hidden:
+			simulation_map.pop(field, None)
+
+	return BSONResponse(status_code=status.HTTP_200_OK, content={
+		"maps": [serialize_simulation_map(simulation_map, raw) for simulation_map in simulation_maps],
+		"next": next_cursor,
+	})
+
+@router.get("/{name}/maps/{map_id}", response_description="Get a single simulation map")
+async def show_simulation_map(name: str, map_id: str, current_user: Annotated[User, Depends(get_current_user)], raw: bool = False, banding: BANDING_SCHEMES = "thirds"):
+	_db = await get_db()
+
+	simulation = await get_visible_simulation(_db, name, current_user)
+
+	if not ObjectId.is_valid(map_id):
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Simulation map not found")
+
+	simulation_map = await _db["simulations_maps"].find_one({"_id": ObjectId(map_id), "simulation_id": ObjectId(simulation['_id'])})
+
+	if not simulation_map:
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Simulation map not found")
+
+	band_simulation_maps([simulation_map], await get_simulation_stats(_db, simulation), banding)
+
+	return BSONResponse(status_code=status.HTTP_200_OK, content=serialize_simulation_map(simulation_map, raw))
+
+EXPORT_CSV_FIELDS = ["_id", "simulation_id", "nodes_count", "edges_count", "entropy", "entropy_percent", "effort", "color_entropy", "color_entropy_percent", "color_effort", "created_at", "canonical_hash", "multiplicity", "adjacency_matrix"]
+
+@router.get("/{name}/export", response_description="Stream every map of a simulation as NDJSON, CSV, Arrow IPC or Parquet")
+async def export_simulation(
+	name: str,
+	current_user: Annotated[User, Depends(get_current_user)],
+	format: Literal["ndjson", "csv", "arrow", "parquet"] = "ndjson",
+	batch_size: int = Query(1000, ge=1, le=10000),
+	raw: bool = False,
+	matrices: bool = False,
+	banding: BANDING_SCHEMES = "thirds",
+):
+	_db = await get_db()
+
+	simulation = await get_visible_simulation(_db, name, current_user)
+	stats = await get_simulation_stats(_db, simulation)
+	_read_db = await get_read_db()
+
+	if format in ("arrow", "parquet") and export.pa is None:
+		raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Columnar exports require pyarrow")
+
+	async def banded_maps():
+		# Colors are derived one cursor batch at a time
+		simulation_maps = []
+		async for simulation_map in _read_db["simulations_maps"].find({"simulation_id": ObjectId(simulation['_id'])}).sort("_id", 1).batch_size(batch_size):
+			simulation_maps.append(simulation_map)
+
+			if len(simulation_maps) >= batch_size:
+				for banded_map in band_simulation_maps(simulation_maps, stats, banding):
+					yield banded_map
+				simulation_maps = []
+
+		for banded_map in band_simulation_maps(simulation_maps, stats, banding):
+			yield banded_map
+
+	cursor = banded_maps()
+
+	# Columnar exports only carry the metrics, plus the packed matrices as a binary column on request
+	if format == "arrow":
+		return StreamingResponse(export.export_simulation_maps_columnar(cursor, format, batch_size, matrices), media_type="application/vnd.apache.arrow.stream", headers={"Content-Disposition": f'attachment; filename="{name}.arrows"'})
+
+	if format == "parquet":
+		return StreamingResponse(export.export_simulation_maps_columnar(cursor, format, batch_size, matrices), media_type="application/vnd.apache.parquet", headers={"Content-Disposition": f'attachment; filename="{name}.parquet"'})
+
+	async def ndjson_rows():
+		lines = []
+		async for simulation_map in cursor:
+			lines.append(json.dumps(serialize_simulation_map(simulation_map, raw)))
+
+			# Flush one cursor batch at a time, so memory does not depend on the simulation size
+			if len(lines) >= batch_size:
+				yield "\n".join(lines) + "\n"
+				lines = []
+
+		if lines:
+			yield "\n".join(lines) + "\n"
+
+	async def csv_rows():
+		buffer = io.StringIO()
+		writer = csv.DictWriter(buffer, fieldnames=EXPORT_CSV_FIELDS, extrasaction="ignore")
+		writer.writeheader()
+
+		rows = 0
+		async for simulation_map in cursor:
+			simulation_map = serialize_simulation_map(simulation_map, raw)
+			if not raw:
+				simulation_map['adjacency_matrix'] = json.dumps(simulation_map['adjacency_matrix'], separators=(",", ":"))
+			writer.writerow(simulation_map)
+			rows += 1
+
+			if rows >= batch_size:
+				yield buffer.getvalue()
+				buffer.seek(0)
+				buffer.truncate()
+				rows = 0
+
+		yield buffer.getvalue()
+
+	if format == "csv":
+		return StreamingResponse(csv_rows(), media_type="text/csv", headers={"Content-Disposition": f'attachment; filename="{name}.csv"'})
+
+	return StreamingResponse(ndjson_rows(), media_type="application/x-ndjson", headers={"Content-Disposition": f'attachment; filename="{name}.ndjson"'})
+
+@router.get("/{name}/status", response_description="Get the progress of a simulation")
+async def show_simulation_status(name: str, current_user: Annotated[User, Depends(get_current_user)]):
+	_db = await get_db()
+
+	simulation = await get_visible_simulation(_db, name, current_user)
+
+	return {"_id": simulation['_id'], **simulation_progress(simulation)}
+
+@router.get("/{name}/events", response_description="Stream the progress of a simulation as server-sent events")
+async def stream_simulation_status(name: str, current_user: Annotated[User, Depends(get_current_user)], interval: float = 1):
+	_db = await get_db()
+
+	simulation = await get_visible_simulation(_db, name, current_user)
+
+	async def events():
+		while True:
+			progress = simulation_progress(simulation)
+			yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+
+			if progress['status'] != 'running':
+				break
+
+			await asyncio.sleep(max(interval, 0.1))
+			simulation.update(await _db["simulations"].find_one({"_id": simulation['_id']}, {"status": 1, "maps_count": 1, "maps_done": 1, "finished_at": 1, "error": 1}))
+
+	return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @router.post("/", response_description="Add a new simulation")
-async def create_simulation(current_user: Annotated[User, Depends(get_current_user)], simulation: Simulation = Body(...)):
+async def create_simulation(current_user: Annotated[User, Depends(get_current_user)], simulation: Simulation = Body(...), background: bool = False):
 	_db = await get_db()
 
 	simulation = jsonable_encoder(simulation)
 	simulation['owner_id'] = current_user['_id']
 	simulation['created_at'] = int(time.time())
 	del simulation['maps']
+	del simulation['stats']
+
+	if simulation['seed'] is None:
+		simulation['seed'] = secrets.randbits(63)
+
+	simulation['status'] = 'running'
+	simulation['maps_done'] = 0
+	simulation['started_at'] = time.time()
+	simulation['heartbeat_at'] = simulation['started_at']
+	simulation['chunk_size'] = default_chunk_size(simulation['node_max'])
+	simulation['chunks_count'] = len(split_chunks(simulation['maps_count'], simulation['chunk_size']))
 	
 	new_simulation = await _db["simulations"].insert_one(simulation)
 	created_simulation = await _db["simulations"].find_one({"_id": new_simulation.inserted_id})
 
-	max_entropy = 0
-	max_entropy_percent = 0
-	max_effort = 0
-
-	maps = []
-	adjacency_matrix_list = []
-	data = []
-
-	# Generate 'n' concept maps
-	for _ in range(created_simulation['maps_count']):
-		map = ConceptMap() # Create ConceptMap object
-		map.generate(created_simulation['node_min'], created_simulation['node_max']) # Generate a random directed acyclic graph (DAG) with given parameters
-		
-		maps.append(map) # Append the generated map in a maps list
-		adjacency_matrix_list.append(map.get_adjacency_matrix()) # Append the adjacency matrix of the generated map in a adjacency matrix list
-
-		if map.get_entropy() > max_entropy:
-			max_entropy = map.get_entropy()
-
-		if map.get_entropy_percent() > max_entropy_percent:
-			max_entropy_percent = map.get_entropy_percent()
-
-		if map.get_effort() > max_effort:
-			max_effort = map.get_effort()
-
-	first_part_entropy = (max_entropy / 3)
-	second_part_entropy = first_part_entropy * 2
-
-	first_part_entropy_percent = (max_entropy_percent / 3)
-	second_part_entropy_percent = first_part_entropy_percent * 2
-
-	first_part_effort = (max_effort / 3)
-	second_part_effort = first_part_effort * 2
-
-	i = 0
-	for map in maps:
-		color_entropy = 0
-		if map.get_entropy() > (first_part_entropy) and map.get_entropy() < second_part_entropy:
-			color_entropy = 1
-		elif map.get_entropy() > second_part_entropy:
-			color_entropy = 2
-
-		color_entropy_percent = 0
-		if map.get_entropy_percent() > (first_part_entropy_percent) and map.get_entropy_percent() < second_part_entropy_percent:
-			color_entropy_percent = 1
-		elif map.get_entropy_percent() > second_part_entropy_percent:
-			color_entropy_percent = 2
-
-		color_effort = 0
-		if map.get_effort() > (first_part_effort) and map.get_effort() < second_part_effort:
-			color_effort = 1
-		elif map.get_effort() > second_part_effort:
-			color_effort = 2
-
-		data.append({
-			'simulation_id': ObjectId(new_simulation.inserted_id), 
-			'color_entropy': color_entropy,
-			'color_entropy_percent': color_entropy_percent,
-			'color_effort': color_effort,
-			'nodes_count': map.get_nodes_count(),
-			'entropy': round(map.get_entropy(), 2),
-			'entropy_percent': round(map.get_entropy_percent(), 2),
-			'effort': round(map.get_effort(), 2),
-			'edges_count': map.get_edges_count(),
-			'created_at': simulation['created_at'],
-			'adjacency_matrix': np.char.mod('%s', adjacency_matrix_list[i]).tolist()
+	await increment_counters(_db, simulation['created_at'], simulations_count=1)
+
+	# Job mode: generate in the background and let the client follow /status or /events
+	if background:
+		start_simulation_job(_db, created_simulation)
+
+		return BSONResponse(status_code=status.HTTP_202_ACCEPTED, content={
+			"_id": simulation['_id'],
+			"job_id": simulation['_id'],
+			"status_url": router.url_path_for("show_simulation_status", name=simulation['name']),
+			"events_url": router.url_path_for("stream_simulation_status", name=simulation['name']),
+		})
+
+	await run_simulation(_db, created_simulation)
+
+	return BSONResponse(status_code=status.HTTP_201_CREATED, content={"_id": simulation['_id']})
+
+@router.post("/{name}/extend", response_description="Append maps to an existing simulation")
+async def extend_simulation(name: str, current_user: Annotated[User, Depends(get_current_user)], maps_count: int = Body(..., embed=True, gt=0), background: bool = False):
+	_db = await get_db()
+
+	simulation = await _db["simulations"].find_one({"name": name})
+
+	if not simulation:
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Simulation not found")
+
+	if simulation['owner_id'] != current_user['_id']:
+		raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not authorized to extend this simulation")
+
+	# The new maps continue the RNG stream after the chunks already generated, simulations created before chunks_count was kept included
+	chunk_size = simulation_chunk_size(simulation)
+	first_chunk = simulation.get('chunks_count', len(split_chunks(simulation['maps_count'], chunk_size)))
+	maps_done = simulation.get('maps_done', simulation['maps_count'])
+
+	# Claim the simulation, a generation or another extension may be running already
+	claimed_at = time.time()
+	claimed = {
+		"status": "running",
+		"started_at": claimed_at,
+		"heartbeat_at": claimed_at,
+		"maps_start": maps_done,
+		"maps_done": maps_done,
+		"maps_count": simulation['maps_count'] + maps_count,
+		"chunks_count": first_chunk + len(split_chunks(maps_count, chunk_size)),
+	}
+	# Simulations created before seeds were kept get one, their previous maps cannot be reproduced anyway
+	if simulation.get('seed') is None:
+		claimed['seed'] = secrets.randbits(63)
+
+	# The claim only holds if nothing changed since the read, or a finished extension would see its chunks generated again
+	simulation = await _db["simulations"].find_one_and_update({
+		"_id": simulation['_id'],
+		"status": {"$ne": "running"},
+		"maps_count": simulation['maps_count'],
+		"chunks_count": simulation['chunks_count'] if 'chunks_count' in simulation else {"$exists": False},
+	}, {"$set": claimed, "$unset": {"finished_at": "", "error": ""}}, return_document=ReturnDocument.AFTER)
+
+	if simulation is None:
+		raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Simulation is already running or was changed meanwhile")
+
+	if background:
+		start_simulation_job(_db, simulation, maps_count, first_chunk)
+
+		return BSONResponse(status_code=status.HTTP_202_ACCEPTED, content={
+			"_id": simulation['_id'],
+			"job_id": simulation['_id'],
+			"status_url": router.url_path_for("show_simulation_status", name=simulation['name']),
+			"events_url": router.url_path_for("stream_simulation_status", name=simulation['name']),
 		})
-		i = i + 1
 
-	await _db["simulations_maps"].insert_many(data)
+	await run_simulation(_db, simulation, maps_count, first_chunk)
 
-	return JSONResponse(status_code=status.HTTP_201_CREATED, content=json.loads(json.dumps({"_id": simulation['_id']})))
+	return BSONResponse(status_code=status.HTTP_200_OK, content={"_id": simulation['_id'], "maps_count": simulation['maps_count']})
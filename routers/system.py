@@ -0,0 +1,36 @@
+from typing import Annotated
+from fastapi import APIRouter, Depends, HTTPException, status
+
+from db import db_stats, get_db
+from dependencies.models import User
+from internals.cache import caches
+from internals.indexes import INDEX_DIAGNOSTICS, explain_queries
+from internals.user import get_current_user
+
+router = APIRouter(
+	prefix="/system",
+	tags=["system"],
+	responses={404: {"description": "Not found"}},
+)
+
+async def get_system_user(current_user: Annotated[User, Depends(get_current_user)]):
+	if current_user['role'] != 1:
+		raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not a teacher")
+
+	return current_user
+
+@router.get("/caches", response_description="Show the in-process caches hit/miss counters")
+async def show_caches(current_user: Annotated[User, Depends(get_system_user)]):
+	return {name: cache.stats() for name, cache in caches.items()}
+
+
+@router.get("/db", response_description="Show the MongoDB client settings and connection pool counters")
+async def show_db(current_user: Annotated[User, Depends(get_system_user)]):
+	return db_stats()
+
+# Every hit runs one explain per representative query against the live database, so it only exists with the diagnostics on
+if INDEX_DIAGNOSTICS:
+	@router.get("/query-plans", response_description="Explain the representative router queries and flag collection scans")
+	async def show_query_plans(current_user: Annotated[User, Depends(get_system_user)]):
+		_db = await get_db()
+		return await explain_queries(_db)
@@ -1,18 +1,17 @@
 from datetime import timedelta
 from typing import Annotated
 from fastapi import APIRouter, Body, Depends, HTTPException, status
-from fastapi.responses import JSONResponse
-from bson import ObjectId, json_util
-import json
+from bson import ObjectId
 from fastapi.encoders import jsonable_encoder
 import time
 import datetime
 
 from pymongo import ReturnDocument
 
+from dependencies.responses import BSONResponse
 from dependencies.models import Token, User, UserAuth, UserUpdate, UserToken
 from internals.auth import ACCESS_TOKEN_EXPIRE_MINUTES, create_access_token, get_password_hash
-from internals.user import authenticate_user, get_current_active_user
+from internals.user import authenticate_user, get_current_active_user, invalidate_principal
 
 from db import get_db
 from internals.user import get_current_user
@@ -42,70 +41,58 @@ async def login_for_access_token(form_data: UserAuth):
 async def read_users_me(current_user: Annotated[UserToken, Depends(get_current_active_user)]):
   return current_user
 
-@router.get("/homeworks", response_description="Show current user homeworks")
-async def show_user_homeworks(current_user: Annotated[User, Depends(get_current_user)]):
-  _db = await get_db()
-
+async def list_user_homeworks(_db, current_user: dict, expired: bool) -> list:
   homeworks = []
 
   ct = datetime.datetime.now()
   dt = ct.timestamp()
 
   if current_user['role'] == 1:
-    classrooms = await _db["classrooms"].find({"teacher_id": current_user['_id']}).to_list(None)
+    classrooms = await _db["classrooms"].find({"teacher_id": current_user['_id']}, {"_id": 1}).to_list(None)
+    classrooms_ids = [classroom['_id'] for classroom in classrooms]
+
+    if classrooms_ids:
+      homeworks = await _db["classrooms_homeworks"].find({'classroom_id': {"$in": classrooms_ids} }).to_list(None)
 
-    if classrooms:
-      for classroom in classrooms:
-        tmp_homeworks = await _db["classrooms_homeworks"].find({'classroom_id': classroom['_id'] }).to_list(None)
-        if tmp_homeworks:
-          homeworks += tmp_homeworks
   elif current_user['role'] == 0:
     student_classrooms = await _db["classrooms_students"].find({'student_id': current_user['_id'] }).to_list(None)
-    for student_classroom in student_classrooms:
-        tmp_homeworks = await _db["classrooms_homeworks"].find({'classroom_id': student_classroom['classroom_id'], "expire_datetime": {"$gte": int(dt)} }).to_list(None)
-        if tmp_homeworks:
-          for tmp_homework in tmp_homeworks:
-            tmp_homework['status'] = 0
-            homework_map = await _db["classrooms_homeworks_maps"].find_one({'homework_id': tmp_homework['_id'], 'student_id': current_user['_id'] })
-            if homework_map:
-              tmp_homework['status'] = 1
+    classrooms_ids = [student_classroom['classroom_id'] for student_classroom in student_classrooms]
 
-            homeworks.append(tmp_homework)
+    if classrooms_ids:
+      expire_datetime = {"$lte": int(dt)} if expired else {"$gte": int(dt)}
+      homeworks = await _db["classrooms_homeworks"].find({'classroom_id': {"$in": classrooms_ids}, "expire_datetime": expire_datetime }).to_list(None)
 
-  return JSONResponse(status_code=status.HTTP_200_OK, content=json.loads(json_util.dumps(homeworks)))
+    if homeworks:
+      homework_maps = await _db["classrooms_homeworks_maps"].find({'homework_id': {"$in": [homework['_id'] for homework in homeworks]}, 'student_id': current_user['_id'] }, {"homework_id": 1}).to_list(None)
+      submitted_homeworks_ids = {homework_map['homework_id'] for homework_map in homework_maps}
 
-@router.get("/homeworks/expired", response_description="Show current user homeworks")
-async def show_user_homeworks(current_user: Annotated[User, Depends(get_current_user)]):
-  _db = await get_db()
+      for homework in homeworks:
+        homework['status'] = 1 if homework['_id'] in submitted_homeworks_ids else 0
 
-  homeworks = []
+  else:
+    return homeworks
 
-  ct = datetime.datetime.now()
-  dt = ct.timestamp()
+  # Keep the homeworks grouped by classroom, in the classrooms order
+  classrooms_order = {classroom_id: idx for idx, classroom_id in reversed(list(enumerate(classrooms_ids)))}
+  homeworks.sort(key=lambda homework: classrooms_order[homework['classroom_id']])
 
-  if current_user['role'] == 1:
-    classrooms = await _db["classrooms"].find({"teacher_id": current_user['_id']}).to_list(None)
+  return homeworks
 
-    if classrooms:
-      for classroom in classrooms:
-        tmp_homeworks = await _db["classrooms_homeworks"].find({'classroom_id': classroom['_id'] }).to_list(None)
-        if tmp_homeworks:
-          homeworks += tmp_homeworks
+@router.get("/homeworks", response_description="Show current user homeworks")
+async def show_user_homeworks(current_user: Annotated[User, Depends(get_current_user)]):
+  _db = await get_db()
 
-  elif current_user['role'] == 0:
-    student_classrooms = await _db["classrooms_students"].find({'student_id': current_user['_id'] }).to_list(None)
-    for student_classroom in student_classrooms:
-        tmp_homeworks = await _db["classrooms_homeworks"].find({'classroom_id': student_classroom['classroom_id'], "expire_datetime": {"$lte": int(dt)} }).to_list(None)
-        if tmp_homeworks:
-          for tmp_homework in tmp_homeworks:
-            tmp_homework['status'] = 0
-            homework_map = await _db["classrooms_homeworks_maps"].find_one({'homework_id': tmp_homework['_id'], 'student_id': current_user['_id'] })
-            if homework_map:
-              tmp_homework['status'] = 1
+  homeworks = await list_user_homeworks(_db, current_user, expired=False)
 
-            homeworks.append(tmp_homework)
+  return BSONResponse(status_code=status.HTTP_200_OK, content=homeworks)
 
-  return JSONResponse(status_code=status.HTTP_200_OK, content=json.loads(json_util.dumps(homeworks)))
+@router.get("/homeworks/expired", response_description="Show current user homeworks")
+async def show_user_expired_homeworks(current_user: Annotated[User, Depends(get_current_user)]):
+  _db = await get_db()
+
+  homeworks = await list_user_homeworks(_db, current_user, expired=True)
+
+  return BSONResponse(status_code=status.HTTP_200_OK, content=homeworks)
 
 @router.post("/", response_description="Add a new user")
 async def create_user(user: User = Body(...)):
@@ -118,14 +105,14 @@ async def create_user(user: User = Body(...)):
   if same_user:
     raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Specified username or email address already exists")
 
-  user['password'] = get_password_hash(user['password'])
+  user['password'] = await get_password_hash(user['password'])
   user['created_at'] = int(time.time())
   user['is_disabled'] = False
 
   new_user = await _db["users"].insert_one(user)
   created_user = await _db["users"].find_one({"_id": new_user.inserted_id})
 
-  return JSONResponse(status_code=status.HTTP_201_CREATED, content=json.loads(json_util.dumps(created_user)))
+  return BSONResponse(status_code=status.HTTP_201_CREATED, content=created_user)
 
 @router.patch("/{user_id}/", response_description="Patch a user")
 async def patch_user(user_id: str, current_user: Annotated[User, Depends(get_current_user)], user: UserUpdate = Body(...)):
@@ -143,7 +130,7 @@ async def patch_user(user_id: str, current_user: Annotated[User, Depends(get_cur
       raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Specified email address already exists")
 
   if user['password']:
-    user['password'] = get_password_hash(user['password'])
+    user['password'] = await get_password_hash(user['password'])
   else:
     del user['password']
 
@@ -152,4 +139,6 @@ async def patch_user(user_id: str, current_user: Annotated[User, Depends(get_cur
   if updated_user is None:
       raise HTTPException(status_code=404, detail=f"Student not found")
 
-  return JSONResponse(status_code=status.HTTP_201_CREATED, content=json.loads(json_util.dumps(updated_user)))
\ No newline at end of file
+  invalidate_principal(current_user['username'])
+
+  return BSONResponse(status_code=status.HTTP_201_CREATED, content=updated_user)
\ No newline at end of file
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from dependencies.generators import get_engine
+from dependencies.scoring import score_batch
+
+NODES_COUNTS = np.repeat(np.arange(3, 16), 150)
+
+def distributions(engine: str) -> dict:
+	adjacency_matrices = get_engine(engine).generate_batch(NODES_COUNTS, np.random.default_rng(42))
+	scores = score_batch(adjacency_matrices, NODES_COUNTS)
+
+	valid = np.arange(adjacency_matrices.shape[1])[None, :] < NODES_COUNTS[:, None]
+	out_degrees = adjacency_matrices.sum(axis=2)
+
+	return {
+		'edges_count': adjacency_matrices.sum(axis=(1, 2)),
+		'entropy': scores['entropy'],
+		'leaves_count': ((out_degrees == 0) & valid).sum(axis=1),
+	}
+
+@pytest.mark.parametrize("metric", ['edges_count', 'entropy', 'leaves_count'])
+def test_engines_agree(metric):
+	numpy_values = distributions("numpy")[metric]
+	networkx_values = distributions("networkx")[metric]
+
+	# Means within 4 standard errors of their difference
+	standard_error = np.sqrt(numpy_values.var() / numpy_values.size + networkx_values.var() / networkx_values.size)
+	assert abs(numpy_values.mean() - networkx_values.mean()) < 4 * standard_error
+
+def test_numpy_maps_are_rooted_dags():
+	adjacency_matrices = get_engine("numpy").generate_batch(NODES_COUNTS, np.random.default_rng(42))
+
+	# Nodes are labelled in topological order: every edge goes forward, and the root alone has no parent
+	assert not np.tril(adjacency_matrices).any()
+
+	for adjacency_matrix, nodes_count in zip(adjacency_matrices, NODES_COUNTS):
+		in_degrees = adjacency_matrix[:nodes_count, :nodes_count].sum(axis=0)
+		assert np.count_nonzero(in_degrees == 0) == 1
+
+@pytest.mark.parametrize("engine", ["numpy", "networkx"])
+@pytest.mark.parametrize("nodes_count", [1, 2])
+def test_small_maps(engine, nodes_count):
+	adjacency_matrix = get_engine(engine).generate(nodes_count, np.random.default_rng(0))
+
+	assert adjacency_matrix.shape == (nodes_count, nodes_count)
+	assert adjacency_matrix.sum() == nodes_count - 1
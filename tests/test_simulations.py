@@ -0,0 +1,80 @@
+import time
+
+import pytest
+from bson import ObjectId
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from fastapi.testclient import TestClient
+
+import app
+import db
+from internals.user import get_current_user
+
+USER = {"_id": ObjectId(), "username": "teacher", "email": "teacher@example.com", "firstname": "T", "lastname": "U", "role": 1, "is_disabled": False}
+
+@pytest.fixture
+def client(monkeypatch):
+	mock_db = mongomock_motor.AsyncMongoMockClient().entropy
+
+	async def setup_db(*args, **kwargs):
+		return mock_db
+
+	monkeypatch.setattr(db, "setup_db", setup_db)
+	monkeypatch.setattr(db, "_db", mock_db)
+	monkeypatch.setattr(db, "_read_db", None)
+	app.app.dependency_overrides[get_current_user] = lambda: USER
+
+	with TestClient(app.app) as test_client:
+		yield test_client, mock_db
+
+	app.app.dependency_overrides.clear()
+
+def legacy_map(simulation_id, created_at) -> dict:
+	# Maps stored before the packed format kept the matrix as rows of "0"/"1" strings
+	return {
+		"simulation_id": simulation_id,
+		"created_at": created_at,
+		"adjacency_matrix": [["0", "1", "1"], ["0", "0", "1"], ["0", "0", "0"]],
+		"nodes_count": 3,
+		"edges_count": 3,
+		"entropy": 1.58,
+		"entropy_percent": 61.3,
+		"effort": 2.0,
+		"color_entropy": 1,
+		"color_entropy_percent": 2,
+		"color_effort": 1,
+	}
+
+def test_extend_legacy_simulation(client):
+	test_client, mock_db = client
+	created_at = int(time.time())
+
+	# Simulations created before this series have no seed, status or chunks
+	simulation_id = test_client.portal.call(mock_db["simulations"].insert_one, {
+		"name": "legacy",
+		"is_public": False,
+		"owner_id": USER["_id"],
+		"node_min": 3,
+		"node_max": 6,
+		"maps_count": 4,
+		"created_at": created_at,
+	}).inserted_id
+	test_client.portal.call(mock_db["simulations_maps"].insert_many, [legacy_map(simulation_id, created_at) for _ in range(4)])
+
+	response = test_client.post("/simulations/legacy/extend", json={"maps_count": 6})
+
+	assert response.status_code == 200
+	assert response.json()["maps_count"] == 10
+
+	simulation = test_client.portal.call(mock_db["simulations"].find_one, {"_id": simulation_id})
+
+	assert isinstance(simulation["seed"], int)
+	assert simulation["status"] == "completed"
+	assert simulation["maps_done"] == 10
+	assert simulation["chunks_count"] > 0
+
+	response = test_client.get("/simulations/legacy/maps", params={"limit": 100})
+
+	assert response.status_code == 200
+	assert len(response.json()["maps"]) == 10